@@ -0,0 +1,63 @@
+import argparse
+import time
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from feature_store import ColumnStore, iter_matrix
+
+
+def feature_columns(fmt = 'csv', path = None):
+    """The model inputs of a feature file: every column after the three key columns."""
+    if fmt == 'npy':
+        return ColumnStore(path).columns[3:]
+    return list(pd.read_csv(path, nrows = 0).columns)[3:]
+
+
+def test_chunks(path, columns, fmt = 'csv', chunk_rows = 100000):
+    """(ids, float32 feature matrix) of every ``chunk_rows`` rows of a test feature file."""
+    if fmt == 'npy':
+        store = ColumnStore(path)
+        start = 0
+        for X in iter_matrix(store, columns, chunk_rows):
+            yield store.read('id', start, start + len(X)), X
+            start += len(X)
+    else:
+        for chunk in pd.read_csv(path, usecols = ['id'] + list(columns), chunksize = chunk_rows):
+            yield chunk['id'].values, chunk[columns].values.astype(np.float32)
+
+
+def predict_to_csv(model, chunks, out, num_threads = 0):
+    """Writes ``id,is_chat`` for every chunk as soon as it is predicted.
+
+    Only one chunk of features and predictions is in memory at a time, so
+    memory does not grow with the test set. ``num_threads = 0`` leaves the
+    thread count to LightGBM. Returns the number of rows written.
+    """
+    rows = 0
+    with open(out, 'w') as f:
+        for ids, X in chunks:
+            if X.shape[1] != model.num_feature():
+                raise ValueError("the model expects {} features, the file has {}".format(model.num_feature(), X.shape[1]))
+            pred = model.predict(X, num_threads = num_threads)
+            pd.DataFrame({'id' : ids, 'is_chat' : pred}).to_csv(f, header = rows == 0, index = False)
+            rows += len(X)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default = "./model.txt", help = 'model file written by train.py')
+    parser.add_argument('--format', choices = ['csv', 'npy'], default = 'csv',
+                        help = 'format prepare_data.py wrote the test features in')
+    parser.add_argument('--chunk-rows', type = int, default = 100000, help = 'test rows read and predicted at a time')
+    parser.add_argument('--threads', type = int, default = 0, help = 'prediction threads, 0 for the LightGBM default')
+    parser.add_argument('--out', default = "./submission.csv")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    path = "../Data/test_features" if args.format == 'npy' else "../Data/test_features.csv"
+    model = lgb.Booster(model_file = args.model)
+    rows = predict_to_csv(model, test_chunks(path, feature_columns(args.format, path), args.format, args.chunk_rows), args.out, args.threads)
+    print("Predicted {} rows in {:.1f} s".format(rows, time.time() - start_time))
@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate(data_dir, edges, seed = 0, nodes = None, exponent = 2.1, chat_rate = 0.2, test_fraction = 0.25, user_fraction = 0.9):
+    """Writes a synthetic train.csv, test.csv and user_features.csv to data_dir.
+
+    Node activity follows a power law with the given exponent, so a few nodes
+    take part in a large share of the rows as in the real contact graph, and
+    chats are likelier between active nodes; the intercept is solved for so
+    that the expected share of chats among the drawn train rows is
+    ``chat_rate``. ``user_fraction`` of the nodes get 13 small integer user
+    features.
+    """
+    rng = np.random.RandomState(seed)
+    nodes = nodes or max(100, edges // 10)
+    activity = rng.pareto(exponent - 1, nodes) + 1
+    p = activity / activity.sum()
+    ids = rng.permutation(nodes)
+    logit = 0.5 * (np.log(activity) - np.log(activity).mean())
+
+    def pairs(n):
+        return rng.choice(nodes, n, p = p), rng.choice(nodes, n, p = p)
+
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    node1, node2 = pairs(edges)
+    pair_logit = logit[node1] + logit[node2]
+    pair_logit += chat_intercept(pair_logit, chat_rate)
+    is_chat = (rng.random_sample(edges) < 1 / (1 + np.exp(-pair_logit))).astype(np.int64)
+    pd.DataFrame({'node1_id' : ids[node1], 'node2_id' : ids[node2], 'is_chat' : is_chat}).to_csv(
+        os.path.join(data_dir, 'train.csv'), index = False)
+    node1, node2 = pairs(int(edges * test_fraction))
+    pd.DataFrame({'id' : np.arange(len(node1)), 'node1_id' : ids[node1], 'node2_id' : ids[node2]}).to_csv(
+        os.path.join(data_dir, 'test.csv'), index = False)
+    users = np.sort(ids[rng.random_sample(nodes) < user_fraction])
+    user_features = pd.DataFrame(rng.randint(0, 32, (len(users), 13)), columns = ['f{}'.format(i) for i in range(1, 14)])
+    user_features.insert(0, 'node_id', users)
+    user_features.to_csv(os.path.join(data_dir, 'user_features.csv'), index = False)
+    return {'edges' : edges, 'nodes' : nodes, 'test_rows' : int(edges * test_fraction), 'users' : len(users), 'seed' : seed}
+
+
+def chat_intercept(pair_logit, chat_rate, iterations = 60):
+    """The shift of ``pair_logit`` at which the mean chat probability is ``chat_rate``.
+
+    The mean is increasing in the shift, so it is found by bisection; a
+    shift outside +-50 would only move probabilities that are already 0 or 1.
+    """
+    low, high = -50.0, 50.0
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        if np.mean(1 / (1 + np.exp(-(pair_logit + mid)))) < chat_rate:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def measure_features(data_dir, folds, options, trace_memory, minhash_hashes = ()):
+    """Builds the given folds in this process and traces every stage."""
+    sys.path.insert(0, CODE_DIR)
+    import prepare_data
+    from stage_trace import StageTrace
+    if trace_memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    prepare_data.load_inputs(data_dir)
+    result = {'load_seconds' : time.perf_counter() - start_time, 'folds' : []}
+    for fold in folds:
+        trace = StageTrace()
+        start_time = time.perf_counter()
+        prepare_data.create_features(fold, trace = trace, **options)
+        result['folds'].append({'fold' : fold, 'seconds' : time.perf_counter() - start_time, 'stages' : trace.records})
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    if minhash_hashes:
+        result['minhash_accuracy'] = minhash_accuracy(folds[0], minhash_hashes, options)
+    return result
+
+
+def minhash_accuracy(fold, hash_counts, options):
+    """Errors of the MinHash contact-overlap estimates against the exact columns on one fold.
+
+    Run after ``measure_features`` has loaded the inputs; every variant's
+    record also has its time and memory, sketch or contact-set build included.
+    """
+    import prepare_data
+    from feature_groups import FoldContext, contact_overlap
+    from stage_trace import StageTrace
+    columns = ['common_contacts_from', 'common_contacts_to', 'common_contacts_from_ratio', 'common_contacts_to_ratio']
+    records = []
+    for num_hashes in [None] + list(hash_counts):
+        trace = StageTrace()
+        context = FoldContext(fold, prepare_data.train, prepare_data.test, prepare_data.user_features, prepare_data.fold_ids,
+                              (prepare_data.node1_counts, prepare_data.node2_counts), minhash = num_hashes, trace = trace, **options)
+        with trace.stage('contact_overlap', rows = len(context.df)) as record:
+            df = contact_overlap(context, context.df[['node1_id', 'node2_id']].copy())
+        record['hashes'] = num_hashes
+        if num_hashes is None:
+            exact = df
+        else:
+            for name in columns:
+                valid = exact[name].values >= 0
+                error = df[name].values[valid] - exact[name].values[valid]
+                record[name] = {'mean_exact' : float(exact[name].values[valid].mean()) if valid.any() else None,
+                                'mean_abs_error' : float(np.abs(error).mean()) if valid.any() else None,
+                                'rmse' : float(np.sqrt((error ** 2).mean())) if valid.any() else None,
+                                'max_abs_error' : float(np.abs(error).max()) if valid.any() else None,
+                                'exact_fraction' : float((error == 0).mean()) if valid.any() else None}
+        records.append(record)
+    return records
+
+
+def run_timed(command, cwd):
+    """Runs command, returning its wall time and the peak RSS of it and its children."""
+    start_time = time.perf_counter()
+    process = subprocess.Popen(command, cwd = cwd, stdout = subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return {'seconds' : time.perf_counter() - start_time, 'peak_rss_mb' : usage.ru_maxrss / 1024.0}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = CODE_DIR, stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_file, new_file):
+    """Prints the per-stage time ratios of two result files."""
+    with open(old_file) as f:
+        old = {run['edges'] : run for run in json.load(f)['runs']}
+    with open(new_file) as f:
+        new = {run['edges'] : run for run in json.load(f)['runs']}
+
+    def stage_seconds(run):
+        seconds = {}
+        for fold in run['features']['folds']:
+            for stage in fold['stages']:
+                seconds[stage['stage']] = seconds.get(stage['stage'], 0) + stage['seconds']
+        return seconds
+
+    for edges in sorted(set(old) & set(new)):
+        before, after = stage_seconds(old[edges]), stage_seconds(new[edges])
+        print("{} edges".format(edges))
+        for name in after:
+            if name in before:
+                print("  {:<34} {:9.3f} s -> {:9.3f} s  x{:.2f}".format(name, before[name], after[name], after[name] / max(before[name], 1e-9)))
+        for stage in ('prepare_all', 'train'):
+            if stage in old[edges] and stage in new[edges]:
+                print("  {:<34} {:9.3f} s -> {:9.3f} s  peak RSS {:.0f} MB -> {:.0f} MB".format(
+                    stage, old[edges][stage]['seconds'], new[edges][stage]['seconds'],
+                    old[edges][stage]['peak_rss_mb'], new[edges][stage]['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--edges', type = int, nargs = '+', default = [100000, 1000000, 10000000],
+                        help = 'sizes of the synthetic training sets')
+    parser.add_argument('--work-dir', default = './benchmark', help = 'where the synthetic data and the runs go')
+    parser.add_argument('--out', default = None, help = 'result file, <work-dir>/results.json by default')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--folds', type = int, nargs = '+', default = [0],
+                        help = 'folds whose feature groups are timed one by one, -1 for the test set')
+    parser.add_argument('--engine', choices = ['networkx', 'sparse'], default = 'sparse',
+                        help = 'backend for the graph features')
+    parser.add_argument('--max-path-depth', type = int, default = None)
+    parser.add_argument('--no-trace-memory', action = 'store_true',
+                        help = 'do not trace the peak allocation per stage, which slows the stages down')
+    parser.add_argument('--minhash-accuracy', type = int, nargs = '+', metavar = 'HASHES', default = [],
+                        help = 'also compare the MinHash contact-overlap columns with these signature sizes to the exact ones on the first fold')
+    parser.add_argument('--train', action = 'store_true',
+                        help = 'also build all folds with prepare_data.py --format npy and time train.py on them')
+    parser.add_argument('--workers', type = int, default = 4, help = 'worker processes for the --train feature build')
+    parser.add_argument('--compare', nargs = 2, metavar = ('OLD', 'NEW'), help = 'compare two result files and exit')
+    parser.add_argument('--measure', default = None, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+    options = {'engine' : args.engine, 'max_path_depth' : args.max_path_depth}
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+    if args.measure:
+        # child process of one size: a fresh process keeps the peak RSS per size
+        with open(args.out, 'w') as f:
+            json.dump(measure_features(args.measure, args.folds, options, not args.no_trace_memory, args.minhash_accuracy), f)
+        sys.exit()
+
+    out = args.out or os.path.join(args.work_dir, 'results.json')
+    results = {'commit' : git_commit(), 'started' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'python' : platform.python_version(),
+               'machine' : platform.machine(), 'cpus' : os.cpu_count(), 'folds' : args.folds, 'trace_memory' : not args.no_trace_memory,
+               'options' : options, 'runs' : []}
+    for edges in args.edges:
+        size_dir = os.path.abspath(os.path.join(args.work_dir, 'edges_{}'.format(edges)))
+        data_dir, run_dir = os.path.join(size_dir, 'Data'), os.path.join(size_dir, 'run')
+        if not os.path.isdir(run_dir):
+            os.makedirs(run_dir)
+        start_time = time.perf_counter()
+        run = generate(data_dir, edges, seed = args.seed)
+        run['generate_seconds'] = time.perf_counter() - start_time
+        print("{} edges: data generated in {:.1f} s".format(edges, run['generate_seconds']))
+
+        command = [sys.executable, os.path.abspath(__file__), '--measure', data_dir, '--out', os.path.join(size_dir, 'features.json'),
+                   '--folds'] + [str(fold) for fold in args.folds] + ['--engine', args.engine]
+        if args.max_path_depth is not None:
+            command += ['--max-path-depth', str(args.max_path_depth)]
+        if args.no_trace_memory:
+            command.append('--no-trace-memory')
+        if args.minhash_accuracy:
+            command += ['--minhash-accuracy'] + [str(hashes) for hashes in args.minhash_accuracy]
+        run_timed(command, run_dir)
+        with open(os.path.join(size_dir, 'features.json')) as f:
+            run['features'] = json.load(f)
+        for fold in run['features']['folds']:
+            print("  fold {}: {:.1f} s, slowest groups {}".format(fold['fold'], fold['seconds'], ", ".join(
+                "{} {:.1f} s".format(stage['stage'], stage['seconds']) for stage in sorted(
+                    [stage for stage in fold['stages'] if stage['parent'] == 'features'], key = lambda stage: -stage['seconds'])[:3])))
+        for record in run['features'].get('minhash_accuracy', []):
+            if record['hashes'] is None:
+                print("  exact contact overlap: {:.2f} s".format(record['seconds']))
+                continue
+            print("  minhash {}: {:.2f} s, mean abs error {}".format(record['hashes'], record['seconds'], ", ".join(
+                "{} {:.3g} (mean {:.3g})".format(name, record[name]['mean_abs_error'], record[name]['mean_exact'])
+                for name in ('common_contacts_from', 'common_contacts_from_ratio') if record[name]['mean_exact'] is not None)))
+
+        if args.train:
+            command = [sys.executable, os.path.join(CODE_DIR, 'prepare_data.py'), '--workers', str(args.workers),
+                       '--format', 'npy', '--engine', args.engine, '--trace-dir', os.path.join(size_dir, 'traces')]
+            if args.max_path_depth is not None:
+                command += ['--max-path-depth', str(args.max_path_depth)]
+            run['prepare_all'] = run_timed(command, run_dir)
+            run['train'] = run_timed([sys.executable, os.path.join(CODE_DIR, 'train.py'), '--format', 'npy',
+                                      '--trace', os.path.join(size_dir, 'traces', 'train.json')], run_dir)
+            print("  all folds {:.1f} s, train.py {:.1f} s, peak RSS {:.0f} MB".format(
+                run['prepare_all']['seconds'], run['train']['seconds'], run['train']['peak_rss_mb']))
+            with open(os.path.join(size_dir, 'traces', 'train.json')) as f:
+                run['train']['stages'] = json.load(f)['stages']
+        results['runs'].append(run)
+        # written after every size, so a long run leaves usable partial results
+        with open(out, 'w') as f:
+            json.dump(results, f, indent = 1)
+    print("Results written to", out)
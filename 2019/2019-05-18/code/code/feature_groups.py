@@ -0,0 +1,899 @@
+import ast
+import hashlib
+import inspect
+import os
+import shutil
+import textwrap
+from functools import cached_property, wraps
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from graph_engine import EdgeIndex, MinHashSketch, NodeIndex, RowGroups, SparseGraph, take_or_nan
+from graph_state import GraphState
+from feature_schema import cast_values, dtype_for, enforce_schema
+from feature_store import ColumnStore, write_columns
+from stage_trace import NO_TRACE
+
+
+def _digest(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            for name in part.columns:
+                digest.update(name.encode())
+                digest.update(np.ascontiguousarray(part[name].values).tobytes())
+        elif isinstance(part, np.ndarray):
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+
+def _lookup(mapping):
+    # Series.map turns a dict into a Series, and hashes its index, on every
+    # call; converted once, a lookup only costs the rows being mapped
+    return pd.Series(mapping, dtype = None if mapping else np.float64)
+
+
+def _add_counts(counts, ids):
+    """A ``_lookup`` of counts with every id in ids counted once more; only new ids cost a copy."""
+    added = pd.Series(ids, dtype = np.int64).value_counts()
+    if len(counts) == 0:
+        return added
+    position = counts.index.get_indexer(added.index)
+    found = position >= 0
+    counts.iloc[position[found]] += added.values[found]
+    return pd.concat([counts, added[~found]]) if not found.all() else counts
+
+
+def _structure(func):
+    """A cached_property whose build is a stage of the context's trace."""
+    @wraps(func)
+    def build(self):
+        with self.trace.stage('context.' + func.__name__, edges = self.graph_rows):
+            return func(self)
+    return cached_property(build)
+
+
+class FoldContext(object):
+    """Inputs of one fold and the graph structures the feature groups share.
+
+    ``df`` holds the rows to build features for (the held-out fold, or the
+    test set for ``i = -1``) and ``graph_df`` the training rows the graphs
+    are built from. Every structure is built on first use, so a fold whose
+    groups all come from the cache never builds a graph; the build is
+    recorded as a ``context.<name>`` stage of ``trace``.
+
+    With a ``state``, ``add_rows`` adds training rows to the context and
+    updates the structures built so far instead of building them again.
+    """
+
+    def __init__(self, i, train, test, user_features, fold_ids, node_counts, state = None,
+                 engine = 'networkx', max_path_depth = None, compact_dtypes = True, minhash = None, warm_pagerank = False,
+                 trace = NO_TRACE):
+        self.i = i
+        if i >= 0:
+            self.df = train[fold_ids == i].reset_index(drop = True)
+            self._graph_df = train[fold_ids != i].reset_index(drop = True)
+        else:
+            self.df = test.copy()
+            self._graph_df = train.copy()
+        self._added = []
+        self.graph_rows = len(self._graph_df)
+        self.user_features = user_features
+        self.node1_counts, self.node2_counts = [_lookup(counts) for counts in node_counts]
+        self.state = state
+        self.trace = trace
+        self.options = {'engine' : engine, 'max_path_depth' : max_path_depth, 'compact_dtypes' : compact_dtypes, 'minhash' : minhash,
+                        'warm_pagerank' : warm_pagerank}
+        # what the rows of a fold depend on: the whole of train and test
+        # (through the node counts), the fold assignment and the fold itself
+        self._inputs = {'pairs' : lambda: _digest(train, test, fold_ids, i),
+                        'user_features' : lambda: _digest(user_features)}
+
+    @property
+    def graph_df(self):
+        """The training rows; rows from ``add_rows`` are appended to it only when it is used."""
+        if self._added:
+            self._graph_df = pd.concat([self._graph_df] + self._added, ignore_index = True)
+            self._added = []
+        return self._graph_df
+
+    def add_rows(self, rows):
+        """Adds (node1_id, node2_id, is_chat) training rows; needs a state.
+
+        The state, the node and chat counts and, with the sparse engine, the
+        CSR graph (``SparseGraph.add_edges``), its triangle counts and the
+        per-node row counts are updated in place, in time proportional to the
+        rows and the degrees of their nodes. Only PageRank, the neighbour
+        degrees and the component labels are computed again, over the CSR
+        arrays. The networkx graphs and everything computed on them are
+        built again on next use.
+        """
+        if self.state is None:
+            raise ValueError("only a context with a state can add rows")
+        if self.options['minhash']:
+            raise ValueError("the MinHash sketches cannot be updated")
+        node1, node2, is_chat = [rows[name].values.astype(np.int64) for name in ('node1_id', 'node2_id', 'is_chat')]
+        self.state.add(node1, node2, is_chat)
+        self._added.append(pd.DataFrame({'node1_id' : node1, 'node2_id' : node2, 'is_chat' : is_chat}))
+        self.graph_rows += len(node1)
+        # the node counts are over train and test, so new rows only add to them
+        self.node1_counts = _add_counts(self.node1_counts, node1)
+        self.node2_counts = _add_counts(self.node2_counts, node2)
+        chats = is_chat == 1
+        if 'connections' in self.__dict__:
+            self.connections = tuple(_add_counts(counts, ids[chats]) for counts, ids in zip(self.connections, (node1, node2)))
+        if self.options['engine'] == 'sparse' and 'sparse_graph' in self.__dict__:
+            old = self.sparse_graph
+            self.sparse_graph = old.add_edges(node1[chats], node2[chats])
+            if 'node_rows' in self.__dict__:
+                self.node_rows = self._moved_node_rows(old, node1, node2, is_chat)
+            stale = ('clusters', 'node_ranks', 'component_stats')
+        else:
+            stale = ('graphs', 'sparse_graph', 'node_rows', 'clusters', 'node_ranks', 'component_stats')
+        # what is built from graph_df, or copied out of the state, is built again if it is used again
+        stale += ('chats', 'chat_nodes', 'contact_index', 'chat_index', 'reverse_contact_stats', 'reverse_connection_stats')
+        for name in stale:
+            self.__dict__.pop(name, None)
+
+    def _moved_node_rows(self, old, node1, node2, is_chat):
+        """``node_rows`` of the old sparse graph carried over to the current one, with the new rows added."""
+        index = self.sparse_graph.index
+        node_rows = np.zeros((4, len(index)))
+        moved = index.lookup(old.index.ids)
+        node_rows[:, moved] = self.node_rows
+        joined = np.ones(len(index), dtype = bool)
+        joined[moved] = False
+        # nodes new to the graph bring all their rows, the new ones included, from the state
+        state = self.state
+        for position, node in zip(np.flatnonzero(joined), index.ids[joined]):
+            node_rows[:, position] = (state.node1_rows[node], state.node1_connections.get(node, 0),
+                                      state.node2_rows[node], state.node2_connections.get(node, 0))
+        for k, nodes in enumerate((node1, node2)):
+            position = index.lookup(nodes)
+            keep = position >= 0
+            keep[keep] = ~joined[position[keep]]
+            np.add.at(node_rows[2 * k], position[keep], 1)
+            np.add.at(node_rows[2 * k + 1], position[keep], is_chat[keep])
+        return node_rows
+
+    def set_rows(self, df):
+        """Makes df the frame ``row_groups`` groups; build_features calls it with the rows it builds features for."""
+        self._rows = df[['node1_id', 'node2_id']]
+        self.__dict__.pop('row_groups', None)
+
+    @cached_property
+    def row_groups(self):
+        """The rows grouped by node1_id and by node2_id, factorized once for every per-node aggregate of the groups."""
+        return RowGroups(self._rows.node1_id.values), RowGroups(self._rows.node2_id.values)
+
+    def digest(self, name):
+        if not isinstance(self._inputs[name], str):
+            self._inputs[name] = self._inputs[name]()
+        return self._inputs[name]
+
+    @_structure
+    def chats(self):
+        return self.graph_df[self.graph_df.is_chat == 1]
+
+    @_structure
+    def chat_nodes(self):
+        """Chat nodes in the order an edge-by-edge build of the graphs meets them."""
+        chats = self.chats
+        return pd.unique(np.column_stack([chats.node1_id.values, chats.node2_id.values]).ravel())
+
+    @_structure
+    def graphs(self):
+        """The directed and undirected networkx chat graphs."""
+        if self.state is not None:
+            return self.state.ordered_graphs(self.chat_nodes)
+        user_graph_directed = nx.DiGraph()
+        for row in self.graph_df[self.graph_df.is_chat == 1].itertuples():
+            user_graph_directed.add_edge(row.node1_id, row.node2_id)
+        user_graph_undirected = nx.Graph()
+        for row in self.graph_df[self.graph_df.is_chat == 1].itertuples():
+            user_graph_undirected.add_edge(row.node1_id, row.node2_id)
+        return user_graph_directed, user_graph_undirected
+
+    @_structure
+    def sparse_graph(self):
+        chats = self.chats
+        return SparseGraph(NodeIndex(np.concatenate([chats.node1_id.values, chats.node2_id.values])), chats.node1_id.values, chats.node2_id.values)
+
+    @_structure
+    def node_rows(self):
+        """Rows and chat rows of every sparse-graph node as node1_id and as node2_id, a (4, nodes) array."""
+        graph_df, index = self.graph_df, self.sparse_graph.index
+        node_rows = np.zeros((4, len(index)))
+        for k, column in enumerate(('node1_id', 'node2_id')):
+            position = index.lookup(graph_df[column].values)
+            keep = position >= 0
+            node_rows[2 * k] = np.bincount(position[keep], minlength = len(index))
+            node_rows[2 * k + 1] = np.bincount(position[keep], weights = graph_df.is_chat.values[keep], minlength = len(index))
+        return node_rows
+
+    @_structure
+    def contacts(self):
+        """node1_id -> set of its node2_ids, and node2_id -> set of its node1_ids."""
+        if self.state is not None:
+            return self.state.node1_contacts, self.state.node2_contacts
+        graph_df = self.graph_df
+        node1_contacts = {row[0] : set(row[1]) for row in graph_df[['node1_id', 'node2_id']].groupby('node1_id').aggregate(tuple).itertuples()}
+        node2_contacts = {row[0] : set(row[1]) for row in graph_df[['node1_id', 'node2_id']].groupby('node2_id').aggregate(tuple).itertuples()}
+        return node1_contacts, node2_contacts
+
+    @_structure
+    def contact_sketches(self):
+        """MinHash sketches of the contact sets, node1_id -> node2_ids and node2_id -> node1_ids."""
+        graph_df = self.graph_df
+        return (MinHashSketch(graph_df.node1_id.values, graph_df.node2_id.values, self.options['minhash']),
+                MinHashSketch(graph_df.node2_id.values, graph_df.node1_id.values, self.options['minhash']))
+
+    @_structure
+    def connections(self):
+        """Number of chat rows per node1_id and per node2_id."""
+        if self.state is not None:
+            return _lookup(self.state.node1_connections), _lookup(self.state.node2_connections)
+        graph_df = self.graph_df
+        node1_connections = graph_df[graph_df.is_chat == 1]['node1_id'].value_counts().to_dict()
+        node2_connections = graph_df[graph_df.is_chat == 1]['node2_id'].value_counts().to_dict()
+        return _lookup(node1_connections), _lookup(node2_connections)
+
+    @_structure
+    def contact_index(self):
+        return EdgeIndex(self.graph_df.node1_id.values, self.graph_df.node2_id.values)
+
+    @_structure
+    def chat_index(self):
+        return EdgeIndex(self.chats.node1_id.values, self.chats.node2_id.values)
+
+    @_structure
+    def user_feature_table(self):
+        """User features as one (feature, node) matrix, its NodeIndex and the feature names.
+
+        With compact dtypes the matrix is stored in the dtype the schema gives
+        the merged columns. An extra last column of -1 is what nodes without
+        user features gather, as ``NodeIndex.lookup`` maps them to -1.
+        """
+        user_features = self.user_features
+        names = [name for name in user_features.columns if name != 'node_id']
+        index = NodeIndex(user_features.node_id.values)
+        values = user_features[names].values
+        if self.options['compact_dtypes']:
+            dtype = np.result_type(*[dtype_for(name + '_x') for name in names])
+            values = cast_values(values, dtype, 'user_features')
+        table = np.full((len(names), len(index) + 1), -1, dtype = values.dtype)
+        table[:, index.lookup(user_features.node_id.values)] = values.T
+        return index, table, names
+
+    # The graph-wide statistics below only depend on graph_df, so the groups
+    # just look them up for their rows; they are arrays over the sparse
+    # graph's or an EdgeIndex's nodes with the sparse engine and dicts keyed
+    # by node id otherwise.
+
+    def reverse_contact_exists(self, node1, node2):
+        try:
+            return 1 if node1 in self.contacts[0][node2] else 0
+        except:
+            return -1
+
+    @_structure
+    def reverse_contact_stats(self):
+        """Per node1_id, the number and fraction of its contacts that contact it back."""
+        graph_df = self.graph_df
+        if self.options['engine'] == 'sparse':
+            contact_index = self.contact_index
+            graph_reverse_contact_exists = contact_index.reverse_contact_exists(graph_df.node1_id.values, graph_df.node2_id.values)
+            num_contacts_with_reverse_contacts, mean_contacts_with_reverse_contacts = contact_index.source_sum_mean(
+                graph_reverse_contact_exists, graph_reverse_contact_exists >= 0)
+            # the row-wise path averages a float16 column, which pandas returns as float32
+            return num_contacts_with_reverse_contacts, mean_contacts_with_reverse_contacts.astype(np.float32).astype(np.float64)
+        if self.state is not None:
+            num_contacts_with_reverse_contacts, mean_contacts_with_reverse_contacts = self.state.reverse_contact_stats()
+            return num_contacts_with_reverse_contacts, {node : float(np.float32(mean)) for node, mean in mean_contacts_with_reverse_contacts.items()}
+        graph_df['reverse_contact_exists'] = [self.reverse_contact_exists(row.node1_id,row.node2_id) for row in graph_df.itertuples()]
+        graph_df['reverse_contact_exists'] = graph_df['reverse_contact_exists'].astype(np.float16)
+        num_contacts_with_reverse_contacts = {row[0] : row[1] for row in graph_df[graph_df.reverse_contact_exists >=0][['node1_id', 'reverse_contact_exists']].groupby('node1_id').sum().itertuples()}
+        mean_contacts_with_reverse_contacts = {row[0] : row[1] for row in graph_df[graph_df.reverse_contact_exists >=0][['node1_id', 'reverse_contact_exists']].groupby('node1_id').mean().itertuples()}
+        return num_contacts_with_reverse_contacts, mean_contacts_with_reverse_contacts
+
+    @_structure
+    def reverse_connection_stats(self):
+        """Per node1_id, the number and fraction of its contacts that chat with it."""
+        graph_df = self.graph_df
+        if self.options['engine'] == 'sparse':
+            return self.contact_index.source_sum_mean(
+                self.chat_index.reverse_exists(graph_df.node1_id.values, graph_df.node2_id.values))
+        if self.state is not None:
+            return self.state.reverse_connection_stats()
+        user_graph_directed = self.graphs[0]
+        graph_df['reverse_connection_exists'] = [user_graph_directed.has_edge(row.node2_id, row.node1_id) for row in graph_df.itertuples()]
+        num_connections_with_reverse_contacts = {row[0] : row[1] for row in graph_df[graph_df.reverse_connection_exists >=0][['node1_id', 'reverse_connection_exists']].groupby('node1_id').sum().itertuples()}
+        mean_connections_with_reverse_contacts = {row[0] : row[1] for row in graph_df[graph_df.reverse_connection_exists >=0][['node1_id', 'reverse_connection_exists']].groupby('node1_id').mean().itertuples()}
+        return num_connections_with_reverse_contacts, mean_connections_with_reverse_contacts
+
+    @_structure
+    def component_stats(self):
+        """Component of every chat node and the chat rate of each component's node1/node2 rows."""
+        if self.options['engine'] == 'sparse':
+            components = self.sparse_graph.connected_components()
+            num_components = components.max() + 1 if len(components) else 0
+            rates = []
+            for rows, chats in self.node_rows.reshape(2, 2, -1):
+                # per-node totals summed per component, which is summing the rows per component
+                rows = np.bincount(components, weights = rows, minlength = num_components)
+                rate = np.full(num_components, np.nan)
+                np.divide(np.bincount(components, weights = chats, minlength = num_components), rows, out = rate, where = rows > 0)
+                rates.append(rate)
+            connected_component_is_chat_mean1, connected_component_is_chat_mean2 = rates
+            return components, connected_component_is_chat_mean1, connected_component_is_chat_mean2
+        graph_df = self.graph_df
+        if self.state is not None:
+            connected_components_index = self.state.components.labels(self.chat_nodes)
+            connected_component_is_chat_mean1, connected_component_is_chat_mean2 = self.state.component_chat_rates(connected_components_index)
+            return connected_components_index, connected_component_is_chat_mean1, connected_component_is_chat_mean2
+        connected_components = list(nx.connected_components(self.graphs[1]))
+        connected_components_index = {n : i for i, c in enumerate(connected_components) for n in c}
+        graph_df['node1_connected_component'] = graph_df.node1_id.map(connected_components_index)
+        graph_df['node2_connected_component'] = graph_df.node2_id.map(connected_components_index)
+        connected_component_is_chat_mean1 = {row[0] : row[1] for row in graph_df[['node1_connected_component', 'is_chat']].groupby('node1_connected_component').mean().itertuples()}
+        connected_component_is_chat_mean2 = {row[0] : row[1] for row in graph_df[['node2_connected_component', 'is_chat']].groupby('node2_connected_component').mean().itertuples()}
+        return connected_components_index, connected_component_is_chat_mean1, connected_component_is_chat_mean2
+
+    @_structure
+    def clusters(self):
+        if self.options['engine'] == 'sparse':
+            return self.sparse_graph.clustering()
+        return nx.cluster.clustering(self.graphs[1])
+
+    @_structure
+    def node_ranks(self):
+        """PageRank and the directed and undirected average neighbour degree of every chat node."""
+        if self.options['engine'] == 'sparse':
+            sparse_graph, state = self.sparse_graph, self.state
+            # a warm start stops at the same tolerance from a different
+            # point, so it only agrees with a cold start to about 1%
+            warm = state is not None and self.options['warm_pagerank']
+            pg_ranks = sparse_graph.pagerank(start = state.last_pagerank if warm else None)
+            if state is not None:
+                state.last_pagerank = (sparse_graph.index.ids, pg_ranks)
+            return (pg_ranks, sparse_graph.average_neighbor_degree(directed = True),
+                    sparse_graph.average_neighbor_degree(directed = False))
+        user_graph_directed, user_graph_undirected = self.graphs
+        return (nx.pagerank(user_graph_directed), nx.average_neighbor_degree(user_graph_directed),
+                nx.average_neighbor_degree(user_graph_undirected))
+
+
+class FeatureGroup(object):
+    """A block of columns ``func(context, df)`` adds to the frame of a fold.
+
+    ``inputs`` names the data the block is computed from, ``options`` the
+    create_features options it reads and ``needs`` the earlier groups whose
+    columns it uses. Before the group runs, missing values in the columns of
+    the earlier groups are filled with ``fill_missing`` unless it is None.
+    """
+
+    def __init__(self, name, func, inputs, options, needs, fill_missing):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.options = options
+        self.needs = needs
+        self.fill_missing = fill_missing
+        self._code = None
+
+    def key(self, context, keys):
+        """Hash of everything the group's columns depend on.
+
+        That is its code (see ``code``), its inputs and options, and the keys
+        of the groups it needs. The dtypes of FEATURE_SCHEMA are not part of
+        it; build_features checks a cached entry's dtypes against them.
+        """
+        return _digest(self.name, self.code(), context.options['compact_dtypes'],
+                       [context.options[name] for name in self.options],
+                       [context.digest(name) for name in self.inputs],
+                       [keys[name] for name in self.needs])
+
+    def code(self):
+        """Hash of the group's source and of every function it reaches.
+
+        Those are the FoldContext members, helpers in this module and
+        graph_engine, graph_state and feature_schema functions whose names
+        its source, or theirs, mentions, plus FoldContext.__init__ and
+        enforce_schema, which every group goes through.
+        """
+        if self._code is None:
+            self._code = _digest(*_reachable_source(inspect.getsource(self.func), 'FoldContext', 'enforce_schema'))
+        return self._code
+
+
+FEATURE_GROUPS = []
+
+
+def feature_group(name, inputs = ('pairs',), options = (), needs = (), fill_missing = None):
+    """Registers the decorated function as the next block of columns."""
+    def register(func):
+        FEATURE_GROUPS.append(FeatureGroup(name, func, inputs, options, needs, fill_missing))
+        return func
+    return register
+
+
+_SOURCE_UNITS = {}
+
+
+def _source_units():
+    """Sources of the functions and methods of this module and the graph, state and schema modules, by name.
+
+    A class name stands for its ``__init__``. The feature groups and module
+    constants are left out.
+    """
+    if not _SOURCE_UNITS:
+        groups = {group.func.__name__ for group in FEATURE_GROUPS}
+        for module in (inspect.getmodule(FoldContext), inspect.getmodule(SparseGraph), inspect.getmodule(GraphState),
+                       inspect.getmodule(enforce_schema)):
+            source = inspect.getsource(module)
+            for node in ast.parse(source).body:
+                if isinstance(node, ast.FunctionDef) and node.name not in groups:
+                    _SOURCE_UNITS.setdefault(node.name, []).append(ast.get_source_segment(source, node))
+                elif isinstance(node, ast.ClassDef):
+                    for item in node.body:
+                        if isinstance(item, ast.FunctionDef):
+                            name = node.name if item.name == '__init__' else item.name
+                            _SOURCE_UNITS.setdefault(name, []).append(textwrap.dedent(ast.get_source_segment(source, item, padded = True)))
+    return _SOURCE_UNITS
+
+
+def _reachable_source(source, *names):
+    """source and the sources of every unit of ``_source_units`` it or they reach by name, sorted.
+
+    Names are matched without types, so a method call reaches every method
+    of that name; that can only add to a key, never leave a dependency out.
+    """
+    units = _source_units()
+    sources, seen = set(), set()
+    pending = [textwrap.dedent(source)] + [unit for name in names for unit in units.get(name, ())]
+    seen.update(names)
+    while pending:
+        source = pending.pop()
+        if source in sources:
+            continue
+        sources.add(source)
+        for node in ast.walk(ast.parse(source)):
+            name = node.id if isinstance(node, ast.Name) else node.attr if isinstance(node, ast.Attribute) else None
+            if name is not None and name not in seen:
+                seen.add(name)
+                pending.extend(units.get(name, ()))
+    return sorted(sources)
+
+
+def _schema_matches(store):
+    """Whether a cached entry's columns have the dtypes FEATURE_SCHEMA gives them now."""
+    try:
+        return all(np.dtype(column['dtype']) == dtype_for(column['name']) for column in store.schema['columns'])
+    except KeyError:
+        return False
+
+
+def build_features(context, cache_dir = None, df = None):
+    """Applies every feature group to the fold in ``context``, in order.
+
+    ``df`` replaces the fold's own rows, e.g. pairs to score against the
+    fold's graph; it cannot be combined with the cache. With a
+    ``cache_dir``, each group's columns are stored under
+    ``<cache_dir>/<fold>/<group>-<key>`` and later runs load them from there
+    as long as the key matches; only groups whose code, inputs or options
+    changed (and the groups that need them) are computed again.
+
+    Each group is a stage of the context's trace, marked ``cached`` when its
+    columns came from the cache; the context structures it is the first to
+    use are stages within it.
+    """
+    if df is None:
+        df = context.df
+    elif cache_dir:
+        raise ValueError("only the fold's own rows can be cached")
+    context.set_rows(df)
+    keys = {}
+    computed = []
+    for group in FEATURE_GROUPS:
+        with context.trace.stage(group.name, rows = len(df)) as record:
+            if group.fill_missing is not None:
+                df = df.fillna(group.fill_missing)
+            path = None
+            if cache_dir:
+                keys[group.name] = group.key(context, keys)
+                path = os.path.join(cache_dir, 'test' if context.i < 0 else 'fold_{}'.format(context.i),
+                                    '{}-{}'.format(group.name, keys[group.name][:16]))
+            store = ColumnStore(path) if path is not None and os.path.isdir(path) else None
+            record['cached'] = store is not None and (not context.options['compact_dtypes'] or _schema_matches(store))
+            if record['cached']:
+                for name in store.columns:
+                    df[name] = np.load(os.path.join(path, name + '.npy'))
+                continue
+            before = set(df.columns)
+            df = group.func(context, df)
+            columns = [name for name in df.columns if name not in before]
+            if context.options['compact_dtypes']:
+                enforce_schema(df, columns)
+            computed.append(group.name)
+            if path:
+                _store(df[columns], path)
+    if context.options['compact_dtypes']:
+        enforce_schema(df)
+    if cache_dir:
+        print("Fold {}: {} of {} feature groups from the cache, computed {}".format(
+            context.i, len(FEATURE_GROUPS) - len(computed), len(FEATURE_GROUPS), ", ".join(computed) or "none"))
+    return df
+
+
+def _store(columns, path):
+    parent, name = os.path.split(path)
+    group = name.rsplit('-', 1)[0]
+    if os.path.isdir(parent):
+        # entries under older keys are never read again
+        for entry in os.listdir(parent):
+            if entry.rsplit('-', 1)[0] == group:
+                shutil.rmtree(os.path.join(parent, entry), ignore_errors = True)
+    # written next to its final place and renamed, so an interrupted run
+    # never leaves a partial entry behind
+    tmp = '{}.tmp{}'.format(path, os.getpid())
+    write_columns(columns, tmp, downcast = False)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors = True)
+
+
+@feature_group('counts')
+def counts(context, df):
+    node1_counts, node2_counts = context.node1_counts, context.node2_counts
+    df['num_contacts_from_node1'] = df.node1_id.map(node1_counts)
+    df['num_contacts_from_node2'] = df.node2_id.map(node1_counts)
+
+    df['num_contacts_to_node1'] = df.node1_id.map(node2_counts)
+    df['num_contacts_to_node2'] = df.node2_id.map(node2_counts)
+
+    df['contacts_from_count'] = df.num_contacts_from_node1 + df.num_contacts_from_node2
+    df['contacts_to_count'] = df.num_contacts_to_node1 + df.num_contacts_to_node2
+
+    df['node_count_from_diff_abs'] = (df.num_contacts_from_node1 - df.num_contacts_from_node2).map(abs)
+    df['node_count_from_diff'] = df.num_contacts_from_node1 - df.num_contacts_from_node2
+
+    df['node_count_to_from_diff_abs'] = (df.num_contacts_to_node1 - df.num_contacts_to_node2).map(abs)
+    df['node_count_to_diff'] = df.num_contacts_to_node1 - df.num_contacts_to_node2
+    return df
+
+
+@feature_group('contact_overlap', options = ('minhash',))
+def contact_overlap(context, df):
+    if context.options['minhash']:
+        # estimated from fixed-size signatures instead of the exact sets
+        from_sketch, to_sketch = context.contact_sketches
+        common_from, from_ratio = from_sketch.overlap(df.node1_id.values, df.node2_id.values)
+        common_to, to_ratio = to_sketch.overlap(df.node1_id.values, df.node2_id.values)
+        df['common_contacts_from'] = common_from
+        df['common_contacts_to'] = common_to
+        df['common_contacts_from_ratio'] = from_ratio
+        df['common_contacts_to_ratio'] = to_ratio
+        return df
+
+    node1_contacts, node2_contacts = context.contacts
+
+    def common_contacts_from(node1, node2):
+        try:
+            return len(node1_contacts[node1].intersection(node1_contacts[node2]))
+        except KeyError:
+            return -1
+    def common_contacts_to(node1, node2):
+        try:
+            return len(node2_contacts[node1].intersection(node2_contacts[node2]))
+        except KeyError:
+            return -1
+
+    def common_contacts_from_ratio(node1, node2):
+        try:
+            return len(node1_contacts[node1].intersection(node1_contacts[node2]))/max(1, len(node1_contacts[node1].union(node1_contacts[node2])))
+        except KeyError:
+            return -1
+    def common_contacts_to_ratio(node1, node2):
+        try:
+            return len(node2_contacts[node1].intersection(node2_contacts[node2])) / max(1, len(node2_contacts[node1].union(node2_contacts[node2])))
+        except KeyError:
+            return -1
+
+    df['common_contacts_from'] = [common_contacts_from(row.node1_id, row.node2_id) for row in df[['node1_id', 'node2_id']].itertuples()]
+    df['common_contacts_to'] = [common_contacts_to(row.node1_id, row.node2_id) for row in df[['node1_id', 'node2_id']].itertuples()]
+    df['common_contacts_from_ratio'] = [common_contacts_from_ratio(row.node1_id, row.node2_id) for row in df[['node1_id', 'node2_id']].itertuples()]
+    df['common_contacts_to_ratio'] = [common_contacts_to_ratio(row.node1_id, row.node2_id) for row in df[['node1_id', 'node2_id']].itertuples()]
+    return df
+
+
+@feature_group('reverse_contacts', options = ('engine',))
+def reverse_contacts(context, df):
+    if context.options['engine'] == 'sparse' and context.state is not None:
+        # looked up per row in the state, which add_rows keeps up to date
+        state = context.state
+        df['reverse_contact_exists'] = state.reverse_contact_exists(df.node1_id.values, df.node2_id.values)
+        (num1, mean1), (num2, mean2) = state.reverse_contact_values(df.node1_id.values), state.reverse_contact_values(df.node2_id.values)
+        df['num_contacts_with_reverse_contacts1'] = num1
+        df['num_contacts_with_reverse_contacts2'] = num2
+        # the row-wise path averages a float16 column, which pandas returns as float32
+        df['mean_contacts_with_reverse_contacts1'] = mean1.astype(np.float32).astype(np.float64)
+        df['mean_contacts_with_reverse_contacts2'] = mean2.astype(np.float32).astype(np.float64)
+    elif context.options['engine'] == 'sparse':
+        num_contacts_with_reverse_contacts, mean_contacts_with_reverse_contacts = context.reverse_contact_stats
+        contact_index = context.contact_index
+        df['reverse_contact_exists'] = contact_index.reverse_contact_exists(df.node1_id.values, df.node2_id.values)
+
+        df['num_contacts_with_reverse_contacts1'] = contact_index.gather(num_contacts_with_reverse_contacts, df.node1_id.values)
+        df['num_contacts_with_reverse_contacts2'] = contact_index.gather(num_contacts_with_reverse_contacts, df.node2_id.values)
+
+        df['mean_contacts_with_reverse_contacts1'] = contact_index.gather(mean_contacts_with_reverse_contacts, df.node1_id.values)
+        df['mean_contacts_with_reverse_contacts2'] = contact_index.gather(mean_contacts_with_reverse_contacts, df.node2_id.values)
+    else:
+        num_contacts_with_reverse_contacts, mean_contacts_with_reverse_contacts = context.reverse_contact_stats
+        df['reverse_contact_exists'] = [context.reverse_contact_exists(row.node1_id,row.node2_id) for row in df.itertuples()]
+
+        df['num_contacts_with_reverse_contacts1'] = df['node1_id'].map(num_contacts_with_reverse_contacts)
+        df['num_contacts_with_reverse_contacts2'] = df['node2_id'].map(num_contacts_with_reverse_contacts)
+
+        df['mean_contacts_with_reverse_contacts1'] = df['node1_id'].map(mean_contacts_with_reverse_contacts)
+        df['mean_contacts_with_reverse_contacts2'] = df['node2_id'].map(mean_contacts_with_reverse_contacts)
+    return df
+
+
+@feature_group('same_node')
+def same_node(context, df):
+    df['same_node'] = df['node1_id'] == df['node2_id']
+    return df
+
+
+@feature_group('components', options = ('engine',))
+def components(context, df):
+    components, connected_component_is_chat_mean1, connected_component_is_chat_mean2 = context.component_stats
+    if context.options['engine'] == 'sparse':
+        sparse_graph = context.sparse_graph
+        node1_component = sparse_graph.gather(components, df.node1_id.values)
+        node2_component = sparse_graph.gather(components, df.node2_id.values)
+        df['node1_connected_component'] = node1_component
+        df['node2_connected_component'] = node2_component
+        df['same_connected_component'] = node1_component == node2_component
+        df['node1_connected_component_count'] = context.row_groups[0].aggregate(node1_component)[0][:, 0]
+        df['node2_connected_component_count'] = context.row_groups[1].aggregate(node2_component)[0][:, 0]
+        df['connected_component_count_diff'] = df['node1_connected_component_count'] - df['node2_connected_component_count']
+        df['connected_component_is_chat_mean1'] = take_or_nan(connected_component_is_chat_mean1, node1_component)
+        df['connected_component_is_chat_mean2'] = take_or_nan(connected_component_is_chat_mean2, node2_component)
+    else:
+        df['node1_connected_component'] = df.node1_id.map(components)
+        df['node2_connected_component'] = df.node2_id.map(components)
+        df['same_connected_component'] = df['node1_connected_component'] == df['node2_connected_component']
+        df['node1_connected_component_count'] = context.row_groups[0].aggregate(df['node1_connected_component'].values)[0][:, 0]
+        df['node2_connected_component_count'] = context.row_groups[1].aggregate(df['node2_connected_component'].values)[0][:, 0]
+        df['connected_component_count_diff'] = df['node1_connected_component_count'] - df['node2_connected_component_count']
+        df['connected_component_is_chat_mean1'] = df['node1_connected_component'].map(connected_component_is_chat_mean1)
+        df['connected_component_is_chat_mean2'] = df['node2_connected_component'].map(connected_component_is_chat_mean2)
+    return df
+
+
+@feature_group('clustering', options = ('engine',))
+def clustering(context, df):
+    clusters = context.clusters
+    if context.options['engine'] == 'sparse':
+        df['node1_cluster_coef'] = context.sparse_graph.gather(clusters, df.node1_id.values)
+        df['node2_cluster_coef'] = context.sparse_graph.gather(clusters, df.node2_id.values)
+    else:
+        df['node1_cluster_coef'] = df.node1_id.map(clusters)
+        df['node2_cluster_coef'] = df.node2_id.map(clusters)
+    df['cluster_coef_diff'] = df['node1_cluster_coef'] - df['node2_cluster_coef']
+    return df
+
+
+@feature_group('reverse_connections', options = ('engine',), needs = ('reverse_contacts',))
+def reverse_connections(context, df):
+    if context.options['engine'] == 'sparse' and context.state is not None:
+        state = context.state
+        df['reverse_connection_exists'] = state.reverse_connection_exists(df.node1_id.values, df.node2_id.values)
+        (num1, mean1), (num2, mean2) = state.reverse_connection_values(df.node1_id.values), state.reverse_connection_values(df.node2_id.values)
+        df['num_connections_with_reverse_contacts1'] = num1
+        df['num_connections_with_reverse_contacts2'] = num2
+        df['mean_connections_with_reverse_contacts1'] = mean1
+        df['mean_connections_with_reverse_contacts2'] = mean2
+    elif context.options['engine'] == 'sparse':
+        num_connections_with_reverse_contacts, mean_connections_with_reverse_contacts = context.reverse_connection_stats
+        contact_index = context.contact_index
+        df['reverse_connection_exists'] = context.chat_index.reverse_exists(df.node1_id.values, df.node2_id.values)
+
+        df['num_connections_with_reverse_contacts1'] = contact_index.gather(num_connections_with_reverse_contacts, df.node1_id.values)
+        df['num_connections_with_reverse_contacts2'] = contact_index.gather(num_connections_with_reverse_contacts, df.node2_id.values)
+
+        df['mean_connections_with_reverse_contacts1'] = contact_index.gather(mean_connections_with_reverse_contacts, df.node1_id.values)
+        df['mean_connections_with_reverse_contacts2'] = contact_index.gather(mean_connections_with_reverse_contacts, df.node2_id.values)
+    else:
+        num_connections_with_reverse_contacts, mean_connections_with_reverse_contacts = context.reverse_connection_stats
+        user_graph_directed = context.graphs[0]
+        df['reverse_connection_exists'] = [user_graph_directed.has_edge(row.node2_id, row.node1_id) for row in df.itertuples()]
+        # df['reverse_connection_fraction_node1'] = df[['node1_id', 'reverse_connection_exists']].groupby('node1_id').transform('mean')
+        # df['reverse_connection_fraction_node2'] = df[['node2_id', 'reverse_connection_exists']].groupby('node2_id').transform('mean')
+
+        df['num_connections_with_reverse_contacts1'] = df['node1_id'].map(num_connections_with_reverse_contacts)
+        df['num_connections_with_reverse_contacts2'] = df['node2_id'].map(num_connections_with_reverse_contacts)
+
+        df['mean_connections_with_reverse_contacts1'] = df['node1_id'].map(mean_connections_with_reverse_contacts)
+        df['mean_connections_with_reverse_contacts2'] = df['node2_id'].map(mean_connections_with_reverse_contacts)
+
+    df['reversed_conection_to_contact_ratio1'] = df['num_connections_with_reverse_contacts1'] / df['num_contacts_with_reverse_contacts1'].map(lambda x : max(1,x))
+    df['reversed_conection_to_contact_ratio2'] = df['num_connections_with_reverse_contacts2'] / df['num_contacts_with_reverse_contacts2'].map(lambda x : max(1,x))
+    return df
+
+
+@feature_group('pagerank', options = ('engine', 'warm_pagerank'))
+def pagerank(context, df):
+    pg_ranks, avg_neighbors, avg_neighbors_undirected = context.node_ranks
+    if context.options['engine'] == 'sparse':
+        sparse_graph = context.sparse_graph
+        df['page_rank_1'] = sparse_graph.gather(pg_ranks, df['node1_id'].values, -1)
+        df['page_rank_2'] = sparse_graph.gather(pg_ranks, df['node2_id'].values, -1)
+        df['avg_neighbors_1_directed'] = sparse_graph.gather(avg_neighbors, df['node1_id'].values, -1)
+        df['avg_neighbors_2_directed'] = sparse_graph.gather(avg_neighbors, df['node2_id'].values, -1)
+        df['avg_neighbors_1_undirected'] = sparse_graph.gather(avg_neighbors_undirected, df['node1_id'].values, -1)
+        df['avg_neighbors_2_undirected'] = sparse_graph.gather(avg_neighbors_undirected, df['node2_id'].values, -1)
+    else:
+        df['page_rank_1'] = df['node1_id'].map(pg_ranks).fillna(-1)
+        df['page_rank_2'] = df['node2_id'].map(pg_ranks).fillna(-1)
+        df['avg_neighbors_1_directed'] = df['node1_id'].map(avg_neighbors).fillna(-1)
+        df['avg_neighbors_2_directed'] = df['node2_id'].map(avg_neighbors).fillna(-1)
+        df['avg_neighbors_1_undirected'] = df['node1_id'].map(avg_neighbors_undirected).fillna(-1)
+        df['avg_neighbors_2_undirected'] = df['node2_id'].map(avg_neighbors_undirected).fillna(-1)
+    df['page_rank_diff'] = df['page_rank_1'] - df['page_rank_2']
+    df['avg_neighbors_directed_diff'] = df['avg_neighbors_1_directed'] - df['avg_neighbors_2_directed']
+    df['avg_neighbors_undirected_diff'] = df['avg_neighbors_1_undirected'] - df['avg_neighbors_2_undirected']
+    return df
+
+
+@feature_group('count_means', needs = ('counts',))
+def count_means(context, df):
+    by_node1, by_node2 = context.row_groups
+    node1_means = by_node1.aggregate(df['num_contacts_to_node1'].values)[2]
+    node2_means = by_node2.aggregate(df['num_contacts_from_node2'].values, df['num_contacts_to_node2'].values)[2]
+    df['avg_node2_from_count'] = node1_means[:, 0]
+    df['avg_node1_from_count'] = node2_means[:, 0]
+    df['avg_node2_to_count'] = node1_means[:, 0]
+    df['avg_node1_to_count'] = node2_means[:, 1]
+    return df
+
+
+@feature_group('connections', needs = ('counts',))
+def connections(context, df):
+    node1_connections, node2_connections = context.connections
+
+    df['node1_connection_from_count'] = df['node1_id'].map(node1_connections)
+    df['node2_connection_from_count'] = df['node2_id'].map(node1_connections)
+    df['node1_connection_to_count'] = df['node1_id'].map(node2_connections)
+    df['node2_connection_to_count'] = df['node2_id'].map(node2_connections)
+
+    df['node_connection_from_sum'] = df['node1_connection_from_count'] + df['node2_connection_from_count']
+    df['node_connection_to_sum'] = df['node1_connection_to_count'] + df['node2_connection_to_count']
+
+    df['node1_connection_from_percentage'] = df['node1_connection_from_count'] / df['num_contacts_from_node1']
+    df['node2_connection_from_percentage'] = df['node2_connection_from_count'] / df['num_contacts_from_node2']
+    df['node1_connection_to_percentage'] = df['node1_connection_to_count'] / df['num_contacts_to_node1']
+    df['node2_connection_to_percentage'] = df['node2_connection_to_count'] / df['num_contacts_to_node2']
+
+    df['node_connection_from_diff'] = df['node1_connection_from_count'] - df['node2_connection_from_count']
+    df['node_connection_to_diff'] = df['node1_connection_to_count'] - df['node2_connection_to_count']
+
+    by_node1, by_node2 = context.row_groups
+    node1_means = by_node1.aggregate(df['node2_connection_from_count'].values, df['node2_connection_to_count'].values)[2]
+    node2_means = by_node2.aggregate(df['node1_connection_from_count'].values, df['node1_connection_to_count'].values)[2]
+    df['avg_node2_connection_from_count'] = node1_means[:, 0]
+    df['avg_node1_connection_from_count'] = node2_means[:, 0]
+    df['avg_node2_connection_to_count'] = node1_means[:, 1]
+    df['avg_node1_connection_to_count'] = node2_means[:, 1]
+    return df
+
+
+@feature_group('common_neighbors', options = ('engine',))
+def common_neighbors(context, df):
+    def get_num_common_neighbors(nodes, g):
+        (u,v) = nodes
+        try:
+            return len(set(g.neighbors(u)).intersection(set(g.neighbors(v))))
+        except:
+            return 0
+    def get_common_neighbors_similarity(nodes, g):
+        (u,v) = nodes
+        try:
+            return len(set(g.neighbors(u)).intersection(set(g.neighbors(v)))) / len(
+                set(g.neighbors(u)).union(set(g.neighbors(v))))
+        except:
+            return 0
+
+    if context.options['engine'] == 'sparse':
+        sparse_graph = context.sparse_graph
+        common_directed, similarity_directed = sparse_graph.common_neighbors(df.node1_id.values, df.node2_id.values, directed = True)
+        common_undirected, similarity_undirected = sparse_graph.common_neighbors(df.node1_id.values, df.node2_id.values, directed = False)
+        df['num_common_neighbors_directed'] = common_directed
+        df['num_common_neighbors_undirected'] = common_undirected
+        df['common_neighbors_similarity_directed'] = similarity_directed
+        df['common_neighbors_similarity_undirected'] = similarity_undirected
+    else:
+        user_graph_directed, user_graph_undirected = context.graphs
+        df['num_common_neighbors_directed'] = [get_num_common_neighbors((row.node1_id, row.node2_id), user_graph_directed) for row in df[['node1_id', 'node2_id']].itertuples()]
+        df['num_common_neighbors_undirected'] = [get_num_common_neighbors((row.node1_id, row.node2_id), user_graph_undirected) for row in df[['node1_id', 'node2_id']].itertuples()]
+        df['common_neighbors_similarity_directed'] = [get_common_neighbors_similarity((row.node1_id, row.node2_id), user_graph_directed) for row in df[['node1_id', 'node2_id']].itertuples()]
+        df['common_neighbors_similarity_undirected'] = [get_common_neighbors_similarity((row.node1_id, row.node2_id), user_graph_undirected) for row in df[['node1_id', 'node2_id']].itertuples()]
+    return df
+
+
+@feature_group('shortest_paths', options = ('engine', 'max_path_depth'))
+def shortest_paths(context, df):
+    def get_shortest_path(nodes, g):
+        (u,v) = nodes
+        try:
+            return nx.shortest_path_length(g, u,v)
+        except:
+            return 1e5
+
+    if context.options['engine'] == 'sparse':
+        sparse_graph, max_path_depth = context.sparse_graph, context.options['max_path_depth']
+        df['shortest_path_length_directed'] = sparse_graph.shortest_path_lengths(df.node1_id.values, df.node2_id.values, directed = True, max_depth = max_path_depth)
+        df['shortest_path_length_undirected'] = sparse_graph.shortest_path_lengths(df.node1_id.values, df.node2_id.values, directed = False, max_depth = max_path_depth)
+    else:
+        user_graph_directed, user_graph_undirected = context.graphs
+        df['shortest_path_length_directed'] = [get_shortest_path((row.node1_id, row.node2_id), user_graph_directed) for row in df[['node1_id', 'node2_id']].itertuples()]
+        df['shortest_path_length_undirected'] = [get_shortest_path((row.node1_id, row.node2_id), user_graph_undirected) for row in df[['node1_id', 'node2_id']].itertuples()]
+    return df
+
+
+# the user features used to be merged in with a fillna(-1) over the whole
+# frame, so the gaps in every earlier column are filled at this point
+@feature_group('user_features', inputs = ('pairs', 'user_features'), fill_missing = -1)
+def user_feature_columns(context, df):
+    index, table, names = context.user_feature_table
+    blocks = []
+    for node_ids in (df.node1_id.values, df.node2_id.values):
+        rows = index.lookup(node_ids)
+        block = table[:, rows]
+        if not context.options['compact_dtypes'] and (rows < 0).any():
+            # the dtype a left merge with gaps and fillna(-1) used to give
+            block = block.astype(np.float64)
+        blocks.append(block)
+    x, y = blocks
+    derived = derived_user_features(x, y, names)
+
+    # the gathered blocks become DataFrame blocks as they are
+    return pd.concat([df, pd.DataFrame(x.T, columns = [name + '_x' for name in names], index = df.index),
+                      pd.DataFrame(y.T, columns = [name + '_y' for name in names], index = df.index),
+                      pd.DataFrame(derived, index = df.index)], axis = 1, copy = False)
+
+
+def derived_user_features(x, y, names):
+    """The columns user_feature_columns derives from the (feature, row) user feature blocks of node1 and node2."""
+    # x and y are (feature, row) blocks, so x.T and y.T have the column-major
+    # layout of the merged frame's values and reduce in the same order
+    feats = [names.index('f{}'.format(i)) for i in range(1,14)]
+    vec1, vec2 = x[feats].T.astype(np.float64), y[feats].T.astype(np.float64)
+    vec1_norm = np.sqrt((vec1 * vec1).sum(axis = 1))
+    vec2_norm = np.sqrt((vec2 * vec2).sum(axis = 1))
+    derived = {'cossim' : (vec1 * vec2 / (vec1_norm * vec2_norm)[:, None]).sum(axis = 1)}
+
+    pairs = [12, 9, 3, 13,6]
+    for i in range(len(pairs)):
+        for j in range(i + 1, len(pairs)):
+            a, b = names.index('f{}'.format(pairs[i])), names.index('f{}'.format(pairs[j]))
+            derived["f{}_x_minus_f{}_x".format(pairs[i],pairs[j])] = (x[a] - x[b]).astype(np.int8)
+            derived["f{}_y_minus_f{}_y".format(pairs[i],pairs[j])] = (y[a] - y[b]).astype(np.int8)
+
+    for side, block in (('x', x[feats]), ('y', y[feats])):
+        derived['f_sum_{}'.format(side)] = block.sum(axis = 0)
+        derived['f_min_{}'.format(side)] = block.min(axis = 0)
+        derived['f_max_{}'.format(side)] = block.max(axis = 0)
+        derived['f_mean_{}'.format(side)] = block.sum(axis = 0, dtype = np.float64) / len(feats)
+
+    for i in range(1,14):
+        k = names.index('f{}'.format(i))
+        derived["f{}_x_minus_f{}_y".format(i,i)] = (x[k] - y[k]).astype(np.int8)
+    return derived
@@ -0,0 +1,95 @@
+from fnmatch import fnmatchcase
+
+import numpy as np
+
+# dtype of every column create_features writes, first matching pattern wins;
+# integer and bool columns must cast losslessly, float columns become float32
+# (the precision train.py hands to LightGBM anyway)
+FEATURE_SCHEMA = [
+    ('id', 'int32'),
+    ('node1_id', 'int32'),
+    ('node2_id', 'int32'),
+    ('is_chat', 'int8'),
+
+    # node1_counts/node2_counts cover every node1/node2 id, the other two lookups can miss
+    ('num_contacts_from_node1', 'int32'),
+    ('num_contacts_to_node2', 'int32'),
+    ('num_contacts_from_node2', 'float32'),
+    ('num_contacts_to_node1', 'float32'),
+    ('contacts_from_count', 'float32'),
+    ('contacts_to_count', 'float32'),
+    ('node_count_*', 'float32'),
+
+    ('common_contacts_*_ratio', 'float32'),
+    ('common_contacts_from', 'int32'),
+    ('common_contacts_to', 'int32'),
+
+    ('reverse_contact_exists', 'int8'),
+    ('reverse_connection_exists', 'bool'),
+    ('num_contacts_with_reverse_contacts?', 'float32'),
+    ('mean_contacts_with_reverse_contacts?', 'float32'),
+    ('num_connections_with_reverse_contacts?', 'float32'),
+    ('mean_connections_with_reverse_contacts?', 'float32'),
+    ('reversed_conection_to_contact_ratio?', 'float32'),
+
+    ('same_node', 'bool'),
+    ('same_connected_component', 'bool'),
+    ('node?_connected_component', 'float32'),
+    ('node?_connected_component_count', 'int32'),
+    ('connected_component_count_diff', 'int32'),
+    ('connected_component_is_chat_mean?', 'float32'),
+
+    ('node?_cluster_coef', 'float32'),
+    ('cluster_coef_diff', 'float32'),
+    ('page_rank_*', 'float32'),
+    ('avg_neighbors_*', 'float32'),
+
+    ('avg_node?_*_count', 'float32'),
+    ('node?_connection_*', 'float32'),
+    ('node_connection_*', 'float32'),
+
+    ('num_common_neighbors_*', 'int32'),
+    ('common_neighbors_similarity_*', 'float32'),
+    ('shortest_path_length_*', 'float32'),
+
+    ('cossim', 'float32'),
+    ('f*_minus_f*', 'int8'),
+    ('f_sum_?', 'int16'),
+    ('f_min_?', 'int8'),
+    ('f_max_?', 'int8'),
+    ('f_mean_?', 'float32'),
+    ('f[0-9]*_[xy]', 'int8'),
+]
+
+
+def dtype_for(name):
+    for pattern, dtype in FEATURE_SCHEMA:
+        if fnmatchcase(name, pattern):
+            return np.dtype(dtype)
+    raise KeyError("column {} is not declared in FEATURE_SCHEMA".format(name))
+
+
+def cast_values(values, dtype, name):
+    """values as dtype; integer and bool casts must not change any value."""
+    cast = values.astype(dtype)
+    if dtype.kind in 'biu' and not np.array_equal(cast, values):
+        raise ValueError("column {} does not fit in {}".format(name, dtype))
+    return cast
+
+
+def enforce_schema(df, columns = None):
+    """Casts every column of df, or the given ones, in place to its declared dtype."""
+    for name in df.columns if columns is None else columns:
+        dtype = dtype_for(name)
+        values = df[name].values
+        if values.dtype != dtype:
+            df[name] = cast_values(values, dtype, name)
+    return df
+
+
+def memory_report(df):
+    usage = df.memory_usage(index = False)
+    by_dtype = usage.groupby(df.dtypes.astype(str).values).sum()
+    return "{} rows x {} columns, {:.1f} MB ({:.1f} MB as float64): {}".format(
+        df.shape[0], df.shape[1], usage.sum() / 1024.0 ** 2, df.shape[0] * df.shape[1] * 8 / 1024.0 ** 2,
+        ", ".join("{} {:.1f} MB".format(dtype, size / 1024.0 ** 2) for dtype, size in by_dtype.items()))
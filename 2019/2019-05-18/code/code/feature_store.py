@@ -0,0 +1,151 @@
+import json
+import os
+
+import lightgbm as lgb
+import numpy as np
+
+KEY_COLUMNS = ['id', 'node1_id', 'node2_id', 'is_chat']
+
+
+def write_columns(df, path, downcast = True):
+    """Writes a feature frame as one .npy file per column plus schema.json.
+
+    Key columns keep their dtype; float64 features are stored as float32, the
+    dtype train.py feeds to LightGBM, and compact dtypes are kept as they are.
+    ``downcast = False`` stores every column exactly as it is.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    schema = {'rows': len(df), 'columns': []}
+    for name in df.columns:
+        values = df[name].values
+        if downcast and name not in KEY_COLUMNS and values.dtype == np.float64:
+            values = values.astype(np.float32)
+        np.save(os.path.join(path, name + '.npy'), values)
+        schema['columns'].append({'name': name, 'dtype': values.dtype.str})
+    with open(os.path.join(path, 'schema.json'), 'w') as f:
+        json.dump(schema, f, indent = 1)
+
+
+class ColumnStore(object):
+    """Read side of ``write_columns``: columns come back memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'schema.json')) as f:
+            self.schema = json.load(f)
+        self.columns = [column['name'] for column in self.schema['columns']]
+
+    def __len__(self):
+        return self.schema['rows']
+
+    def column(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode = 'r')
+
+    def read(self, name, start, stop):
+        """Rows start:stop of a column, read from the file rather than mapped.
+
+        Mapped pages stay resident once touched, so a pass over a whole
+        column through ``column`` grows the RSS by the column's size.
+        """
+        with open(os.path.join(self.path, name + '.npy'), 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            dtype = header(f)[2]
+            f.seek(start * dtype.itemsize, os.SEEK_CUR)
+            return np.fromfile(f, dtype = dtype, count = stop - start)
+
+
+def read_matrix(stores, columns, dtype = np.float32):
+    """Stacks the given columns of several stores into one 2-d array.
+
+    The result is allocated once and filled straight from the memory-mapped
+    columns, so no DataFrame or float64 copy is ever built.
+    """
+    out = np.empty((sum(len(store) for store in stores), len(columns)), dtype = dtype)
+    start = 0
+    for store in stores:
+        end = start + len(store)
+        for j, name in enumerate(columns):
+            out[start : end, j] = store.column(name)
+        start = end
+    return out
+
+
+def read_column(stores, name):
+    return np.concatenate([store.column(name) for store in stores])
+
+
+def iter_matrix(store, columns, chunk_rows, dtype = np.float32):
+    """``read_matrix`` of one store, ``chunk_rows`` rows at a time.
+
+    The chunks are read rather than mapped, so memory stays at one chunk
+    however large the store is.
+    """
+    for start in range(0, len(store), chunk_rows):
+        end = min(start + chunk_rows, len(store))
+        out = np.empty((end - start, len(columns)), dtype = dtype)
+        for j, name in enumerate(columns):
+            out[:, j] = store.read(name, start, end)
+        yield out
+
+
+def read_rows(stores, columns, rows, dtype = np.float32):
+    """``read_matrix(stores, columns)[rows]`` for sorted row numbers, without the whole matrix."""
+    out = np.empty((len(rows), len(columns)), dtype = dtype)
+    start = 0
+    for store in stores:
+        end = start + len(store)
+        low, high = np.searchsorted(rows, [start, end])
+        for j, name in enumerate(columns):
+            out[low : high, j] = store.column(name)[rows[low : high] - start]
+        start = end
+    return out
+
+
+class StoreSequence(lgb.Sequence):
+    """Rows of a ColumnStore as a ``lgb.Sequence``, read with ``ColumnStore.read``.
+
+    LightGBM pulls ``batch_size`` rows at a time, so a Dataset built from
+    these never needs more than one batch of raw feature values in memory.
+    """
+
+    def __init__(self, store, columns, batch_size = 1 << 16):
+        self.store = store
+        self.names = list(columns)
+        self.rows = len(store)
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, slice):
+            idx = int(idx) % self.rows
+            return np.array([self.store.read(name, idx, idx + 1)[0] for name in self.names], dtype = np.float64)
+        start, stop, step = idx.indices(self.rows)
+        stop = max(start, stop)
+        out = np.empty((stop - start, len(self.names)), dtype = np.float32)
+        for j, name in enumerate(self.names):
+            out[:, j] = self.store.read(name, start, stop)
+        return out[::step]
+
+
+def store_dataset(stores, columns, label, params, reference = None, batch_size = 1 << 16):
+    """A ``lgb.Dataset`` of the stores, built batch by batch from StoreSequences.
+
+    LightGBM bins a Dataset made of Sequences without ``min_data_in_leaf``
+    (``Dataset.get_params`` leaves it out), so its feature pre-filter keeps
+    features a Dataset built from the whole matrix drops. Without a
+    ``reference``, the bins therefore come from one built from the rows
+    LightGBM samples for the whole matrix (its own sampler and seed), with
+    ``min_data_in_leaf`` scaled to the sample the way the pre-filter scales
+    it: the bins and the used features are then those of the in-memory path.
+    """
+    if reference is None:
+        rows = sum(len(store) for store in stores)
+        sample = np.sort(lgb.Dataset(None, params = params)._create_sample_indices(rows))
+        min_data_in_leaf = params.get('min_data_in_leaf', 20) * len(sample) // rows
+        reference = lgb.Dataset(read_rows(stores, columns, sample), params = dict(params, min_data_in_leaf = min_data_in_leaf))
+    return lgb.Dataset([StoreSequence(store, columns, batch_size) for store in stores], read_column(stores, label),
+                       reference = reference, params = params)
@@ -0,0 +1,430 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+
+class NodeIndex(object):
+    """Maps raw node ids to dense integers 0..n-1 (unknown ids map to -1)."""
+
+    def __init__(self, ids):
+        self.ids = np.unique(np.asarray(ids, dtype = np.int64))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, values):
+        values = np.asarray(values, dtype = np.int64)
+        pos = np.searchsorted(self.ids, values)
+        pos[pos == len(self.ids)] = 0
+        found = self.ids[pos] == values if len(self.ids) else np.zeros(len(values), dtype = bool)
+        return np.where(found, pos, -1)
+
+    def gather(self, values, nodes, missing = np.nan):
+        """Per-node ``values`` looked up for raw node ids, ``missing`` for unknown ids."""
+        idx = self.lookup(nodes)
+        return np.where(idx >= 0, values[np.maximum(idx, 0)], missing) if len(values) else np.full(len(idx), missing)
+
+
+def _gather_neighbors(indptr, indices, nodes):
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return indices[offsets]
+
+
+def _blocks(costs, budget):
+    """Consecutive ``(start, stop)`` ranges of rows whose costs add up to at
+    most ``budget``; a row that is over it on its own gets a range to itself."""
+    ends = np.cumsum(costs)
+    start = 0
+    while start < len(ends):
+        base = ends[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(ends, base + budget, side = 'right')))
+        yield start, stop
+        start = stop
+
+
+def group_mean(groups, values, size):
+    """Mean of ``values`` per group id in ``0..size-1``; rows with a negative
+    group are skipped and empty groups get NaN."""
+    keep = groups >= 0
+    counts = np.bincount(groups[keep], minlength = size)
+    sums = np.bincount(groups[keep], weights = values[keep], minlength = size)
+    means = np.full(size, np.nan)
+    np.divide(sums, counts, out = means, where = counts > 0)
+    return means
+
+
+class RowGroups(object):
+    """Rows grouped by a key column, for ``groupby(key).transform`` aggregates.
+
+    The keys are factorized once, into a sparse (keys, rows) indicator
+    matrix; ``aggregate`` then reduces any number of value columns in one
+    product with it and broadcasts the results back to the rows.
+    """
+
+    def __init__(self, keys):
+        _, self.inverse = np.unique(np.asarray(keys), return_inverse = True)
+        rows = len(self.inverse)
+        self.indicator = sp.csr_matrix((np.ones(rows), (self.inverse, np.arange(rows))),
+                                       shape = (self.inverse.max() + 1 if rows else 0, rows))
+
+    def aggregate(self, *columns):
+        """Count, sum and mean of the non-NaN values of each column over the rows sharing a row's key.
+
+        Three (rows, columns) arrays, like ``transform('count')``,
+        ``transform('sum')`` and ``transform('mean')`` of every column; the
+        mean is NaN where a key has no values.
+        """
+        values = np.column_stack(columns).astype(np.float64)
+        valid = ~np.isnan(values)
+        totals = self.indicator @ np.hstack([np.where(valid, values, 0), valid])
+        sums, counts = totals[:, :len(columns)], totals[:, len(columns):]
+        means = np.full(sums.shape, np.nan)
+        np.divide(sums, counts, out = means, where = counts > 0)
+        return counts.astype(np.int64)[self.inverse], sums[self.inverse], means[self.inverse]
+
+
+def take_or_nan(values, positions):
+    """``values[positions]`` for float positions that may be NaN, giving NaN there."""
+    valid = ~np.isnan(positions)
+    out = np.full(len(positions), np.nan)
+    out[valid] = values[positions[valid].astype(np.int64)]
+    return out
+
+
+def _binary_csr(rows, cols, n):
+    adj = sp.csr_matrix((np.ones(len(rows), dtype = np.int32), (rows, cols)), shape = (n, n))
+    adj.sum_duplicates()
+    adj.data.fill(1)
+    return adj
+
+
+class SparseGraph(object):
+    """Chat graph held as directed and undirected CSR adjacency over dense node ids.
+
+    Mirrors the ``nx.DiGraph``/``nx.Graph`` pair built in ``create_features``:
+    duplicate edges collapse to one, the directed neighbours of a node are its
+    successors and self loops are kept.
+    """
+
+    def __init__(self, index, src, dst, first_seen = None):
+        self.index = index
+        n = len(index)
+        src = index.lookup(src)
+        dst = index.lookup(dst)
+        self.directed = _binary_csr(src, dst, n)
+        self.undirected = _binary_csr(np.concatenate([src, dst]), np.concatenate([dst, src]), n)
+        self.out_degree = np.diff(self.directed.indptr)
+        self.degree = np.diff(self.undirected.indptr)
+        # position of each node in the order an edge-by-edge networkx build
+        # would insert it; every node has one since nodes come from the edges
+        if first_seen is None:
+            first_seen = np.unique(np.column_stack([src, dst]).ravel(), return_index = True)[1]
+        self.first_seen = first_seen
+        # twice the triangles through each node, once clustering has counted them
+        self._triangles = None
+
+    def add_edges(self, src, dst, block_nnz = 1 << 24):
+        """The graph with the edges (src[k], dst[k]) added, as if they were appended to the rows it was built from.
+
+        Nodes met first in the new edges come after all the old ones. Built
+        from the CSR arrays instead of the rows; triangle counts carry over,
+        and only the nodes the new edges can close a triangle with are
+        counted again.
+        """
+        src = np.asarray(src, dtype = np.int64)
+        dst = np.asarray(dst, dtype = np.int64)
+        if len(src) == 0:
+            return self
+        index = NodeIndex(np.concatenate([self.index.ids, src, dst]))
+        moved = index.lookup(self.index.ids)
+        first_seen = np.full(len(index), -1, dtype = np.int64)
+        first_seen[moved] = self.first_seen
+        nodes, position = np.unique(index.lookup(np.column_stack([src, dst]).ravel()), return_index = True)
+        joined = first_seen[nodes] < 0
+        first_seen[nodes[joined]] = (self.first_seen.max() + 1 if len(self.first_seen) else 0) + position[joined]
+        old = self.directed.tocoo()
+        graph = SparseGraph(index, np.concatenate([self.index.ids[old.row], src]), np.concatenate([self.index.ids[old.col], dst]), first_seen)
+        if self._triangles is not None:
+            triangles = np.zeros(len(index), dtype = np.int64)
+            triangles[moved] = self._triangles
+            # a new edge only changes the counts of its ends and of the common neighbours of its ends
+            u, v = index.lookup(src), index.lookup(dst)
+            touched = [u, v]
+            for start, stop in _blocks(graph.degree[u] + graph.degree[v], block_nnz):
+                touched.append(graph.undirected[u[start : stop]].multiply(graph.undirected[v[start : stop]]).tocsr().indices)
+            touched = np.unique(np.concatenate(touched))
+            triangles[touched] = graph.triangles(touched, block_nnz)
+            graph._triangles = triangles
+        return graph
+
+    def adjacency(self, directed):
+        return self.directed if directed else self.undirected
+
+    def gather(self, values, nodes, missing = np.nan):
+        return self.index.gather(values, nodes, missing)
+
+    def pagerank(self, alpha = 0.85, max_iter = 100, tol = 1.0e-06, start = None):
+        """PageRank of the directed graph by power iteration on the CSR matrix.
+
+        Follows ``nx.pagerank`` (uniform teleport and dangling weights, L1
+        stopping rule scaled by the node count), so values agree with it to
+        within ``tol``.  ``start`` is an optional ``(node_ids, values)`` pair,
+        typically the result for an overlapping graph; nodes it does not
+        cover start at ``1 / n``.
+        """
+        n = len(self.index)
+        if n == 0:
+            return np.zeros(0)
+        inv_degree = np.zeros(n)
+        inv_degree[self.out_degree > 0] = 1.0 / self.out_degree[self.out_degree > 0]
+        # x @ W with W the row-normalised adjacency, as W.T @ x on a CSR matrix
+        transition = (sp.diags(inv_degree) @ self.directed).T.tocsr()
+        dangling = self.out_degree == 0
+        x = np.full(n, 1.0 / n)
+        if start is not None:
+            idx = self.index.lookup(start[0])
+            x[idx[idx >= 0]] = start[1][idx >= 0]
+            x /= x.sum()
+        for _ in range(max_iter):
+            xlast = x
+            x = alpha * (transition @ x + x[dangling].sum() / n) + (1 - alpha) / n
+            if np.absolute(x - xlast).sum() < n * tol:
+                return x
+        raise RuntimeError("pagerank did not converge in {} iterations".format(max_iter))
+
+    def average_neighbor_degree(self, directed):
+        """Mean degree of each node's neighbours, as ``nx.average_neighbor_degree``.
+
+        Directed graphs use out-degrees of successors; undirected degrees
+        count a self loop twice.  Nodes without neighbours get 0.
+        """
+        adj = self.adjacency(directed)
+        if directed:
+            degree = self.out_degree
+        else:
+            degree = self.degree + (adj.diagonal() > 0)
+        total = adj @ degree.astype(np.float64)
+        avg = np.zeros(len(self.index))
+        np.divide(total, degree, out = avg, where = degree > 0)
+        return avg
+
+    def _simple(self):
+        """The undirected adjacency without self loops, as int64."""
+        adj = self.undirected.copy()
+        adj.setdiag(0)
+        adj.eliminate_zeros()
+        return adj.astype(np.int64)
+
+    def triangles(self, nodes = None, block_nnz = 1 << 24):
+        """Twice the number of triangles through each of the given node positions (all nodes by default).
+
+        Counted from ``A @ A`` masked by ``A``, with self loops ignored as in
+        ``nx.clustering``. The product has about sum(deg²) entries, so it is
+        taken over blocks of rows whose share of it, at most n per row, adds
+        up to ``block_nnz``.
+        """
+        adj = self._simple()
+        nodes = np.arange(len(self.index)) if nodes is None else np.asarray(nodes)
+        costs = np.minimum(adj @ np.diff(adj.indptr), len(self.index))[nodes]
+        triangles = np.zeros(len(nodes), dtype = np.int64)
+        for start, stop in _blocks(costs, block_nnz):
+            rows = adj[nodes[start : stop]]
+            triangles[start : stop] = np.asarray((rows @ adj).multiply(rows).sum(axis = 1)).ravel()
+        return triangles
+
+    def clustering(self, block_nnz = 1 << 24):
+        """Clustering coefficient of each node of the undirected graph, as ``nx.clustering``.
+
+        The triangle counts are kept for ``add_edges``.
+        """
+        if self._triangles is None:
+            self._triangles = self.triangles(block_nnz = block_nnz)
+        degree = self.degree - (self.undirected.diagonal() > 0)
+        coef = np.zeros(len(self.index))
+        np.divide(self._triangles, degree * (degree - 1), out = coef, where = self._triangles > 0)
+        return coef
+
+    def connected_components(self):
+        """Component label of every node as an int32 array.
+
+        Labels are numbered like ``enumerate(nx.connected_components(g))``:
+        by the first node of each component in insertion order.
+        """
+        count, labels = connected_components(self.undirected, directed = False)
+        first = np.full(count, np.iinfo(np.int64).max)
+        np.minimum.at(first, labels, self.first_seen)
+        rank = np.empty(count, dtype = np.int32)
+        rank[np.argsort(first)] = np.arange(count, dtype = np.int32)
+        return rank[labels]
+
+    def common_neighbors(self, node1, node2, directed, block_nnz = 1 << 24):
+        """Common-neighbour counts and Jaccard similarities for all pairs at once.
+
+        The pairs are taken in batches that gather at most ``block_nnz``
+        adjacency entries, ``deg(u) + deg(v)`` per pair, so memory does not
+        grow with the hubs. Pairs with a node outside the graph get 0 for
+        both, like the ``except`` fallbacks of the row-wise helpers.
+        """
+        adj = self.adjacency(directed)
+        deg = self.out_degree if directed else self.degree
+        u = self.index.lookup(node1)
+        v = self.index.lookup(node2)
+        valid = np.flatnonzero((u >= 0) & (v >= 0))
+        counts = np.zeros(len(u), dtype = np.int64)
+        for start, stop in _blocks(deg[u[valid]] + deg[v[valid]], block_nnz):
+            rows = valid[start : stop]
+            both = adj[u[rows]].multiply(adj[v[rows]])
+            counts[rows] = np.asarray(both.sum(axis = 1)).ravel()
+        union = np.zeros(len(u), dtype = np.int64)
+        union[valid] = deg[u[valid]] + deg[v[valid]] - counts[valid]
+        similarity = np.zeros(len(u), dtype = np.float64)
+        np.divide(counts, union, out = similarity, where = union > 0)
+        return counts, similarity
+
+    def shortest_path_lengths(self, node1, node2, directed, max_depth = None, missing = 1e5):
+        """Hop distances for all pairs, one breadth-first search per source node.
+
+        Each search stops once all targets of its source are reached, the
+        frontier runs empty or ``max_depth`` hops have been expanded.  Pairs
+        that are unreachable, further away than ``max_depth`` or have a node
+        outside the graph get ``missing``.
+        """
+        adj = self.adjacency(directed)
+        u = self.index.lookup(node1)
+        v = self.index.lookup(node2)
+        lengths = np.full(len(u), missing, dtype = np.float64)
+        valid = np.flatnonzero((u >= 0) & (v >= 0))
+        order = valid[np.argsort(u[valid], kind = 'mergesort')]
+        sources, starts = np.unique(u[order], return_index = True)
+        ends = np.append(starts[1:], len(order))
+        # distances are kept in one array for all searches and only the
+        # entries touched by a search are reset afterwards
+        dist = np.full(len(self.index), -1, dtype = np.int32)
+        for source, start, end in zip(sources, starts, ends):
+            rows = order[start : end]
+            targets = v[rows]
+            frontier = np.array([source])
+            touched = [frontier]
+            dist[source] = 0
+            depth = 0
+            while len(frontier) and (max_depth is None or depth < max_depth) and (dist[targets] < 0).any():
+                depth += 1
+                frontier = _gather_neighbors(adj.indptr, adj.indices, frontier)
+                frontier = np.unique(frontier[dist[frontier] < 0])
+                dist[frontier] = depth
+                touched.append(frontier)
+            found = dist[targets]
+            lengths[rows] = np.where(found >= 0, found, missing)
+            for nodes in touched:
+                dist[nodes] = -1
+        return lengths
+
+
+class EdgeIndex(object):
+    """Rows of (node1, node2) edges with the distinct edges packed into sorted int64 keys.
+
+    Membership of a whole column of pairs is one ``searchsorted``, and the
+    per-node aggregations over the rows are ``bincount`` reductions.
+    """
+
+    def __init__(self, node1, node2):
+        self.index = NodeIndex(np.concatenate([node1, node2]))
+        self.node1 = self.index.lookup(node1)
+        self.node2 = self.index.lookup(node2)
+        self.keys = np.unique(self._pack(self.node1, self.node2))
+        self.is_source = np.bincount(self.node1, minlength = len(self.index)) > 0
+
+    def _pack(self, u, v):
+        return u * np.int64(len(self.index)) + v
+
+    def _contains(self, u, v):
+        keys = self._pack(u, v)
+        pos = np.searchsorted(self.keys, keys)
+        pos[pos == len(self.keys)] = 0
+        return (u >= 0) & (v >= 0) & (self.keys[pos] == keys) if len(self.keys) else np.zeros(len(u), dtype = bool)
+
+    def reverse_exists(self, node1, node2):
+        """Whether (node2, node1) is an edge, for every pair."""
+        return self._contains(self.index.lookup(node2), self.index.lookup(node1))
+
+    def reverse_contact_exists(self, node1, node2):
+        """Like ``reverse_exists`` as 1/0, but -1 where node2 has no edges of its own."""
+        u = self.index.lookup(node1)
+        v = self.index.lookup(node2)
+        has_edges = np.zeros(len(v), dtype = bool)
+        has_edges[v >= 0] = self.is_source[v[v >= 0]]
+        return np.where(has_edges, self._contains(v, u), -1)
+
+    def source_sum_mean(self, values, mask = None):
+        """Sum and mean of one value per row, grouped by the row's node1.
+
+        Nodes without (unmasked) rows get NaN, like a missing key of a
+        ``groupby('node1_id')`` result.
+        """
+        groups = self.node1 if mask is None else self.node1[mask]
+        values = values if mask is None else values[mask]
+        counts = np.bincount(groups, minlength = len(self.index))
+        sums = np.bincount(groups, weights = values, minlength = len(self.index))
+        sums[counts == 0] = np.nan
+        return sums, sums / np.maximum(counts, 1)
+
+    def gather(self, values, nodes):
+        return self.index.gather(values, nodes)
+
+
+def _mix64(x):
+    """splitmix64 finaliser: a bijective, well-mixed hash of uint64 values."""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+class MinHashSketch(object):
+    """Fixed-size MinHash signatures of the set of members of every key.
+
+    Built from (key, member) rows: position h of a key's signature is the
+    smallest h-th hash over its members, and the signatures of all keys are
+    one (keys, num_hashes) uint64 array next to the exact set sizes. The
+    fraction of equal positions in two signatures estimates the Jaccard
+    similarity J of the two sets with a standard error of
+    sqrt(J(1 - J) / num_hashes), and the intersection is J(|A| + |B|)/(1 + J).
+    """
+
+    def __init__(self, keys, members, num_hashes = 64, seed = 0):
+        self.index = NodeIndex(keys)
+        key = self.index.lookup(keys)
+        members = np.asarray(members, dtype = np.int64)
+        # distinct (key, member) rows, grouped by key
+        order = np.lexsort((members, key))
+        key, members = key[order], members[order]
+        distinct = np.ones(len(key), dtype = bool)
+        distinct[1:] = (key[1:] != key[:-1]) | (members[1:] != members[:-1])
+        key, members = key[distinct], members[distinct].view(np.uint64)
+        self.sizes = np.bincount(key, minlength = len(self.index))
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.zeros(0, dtype = np.int64)
+        seeds = _mix64(np.arange(num_hashes, dtype = np.uint64) + np.uint64(seed) * np.uint64(num_hashes) + np.uint64(1))
+        self.signatures = np.empty((len(self.index), num_hashes), dtype = np.uint64)
+        for h in range(num_hashes):
+            if len(key):
+                self.signatures[:, h] = np.minimum.reduceat(_mix64(members ^ seeds[h]), starts)
+
+    def overlap(self, keys1, keys2, batch_size = 1 << 16):
+        """Estimated intersection sizes and Jaccard similarities of the sets of keys1[k] and keys2[k].
+
+        Pairs with a key that has no members get -1 for both, like the
+        ``KeyError`` fallbacks of the exact row-wise helpers.
+        """
+        u = self.index.lookup(keys1)
+        v = self.index.lookup(keys2)
+        valid = np.flatnonzero((u >= 0) & (v >= 0))
+        similarity = np.full(len(u), -1, dtype = np.float64)
+        for start in range(0, len(valid), batch_size):
+            rows = valid[start : start + batch_size]
+            similarity[rows] = (self.signatures[u[rows]] == self.signatures[v[rows]]).mean(axis = 1)
+        counts = np.full(len(u), -1, dtype = np.int64)
+        sizes = self.sizes[u[valid]] + self.sizes[v[valid]]
+        estimate = np.rint(similarity[valid] * sizes / (1 + similarity[valid])).astype(np.int64)
+        counts[valid] = np.minimum(estimate, np.minimum(self.sizes[u[valid]], self.sizes[v[valid]]))
+        return counts, similarity
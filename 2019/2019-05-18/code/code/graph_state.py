@@ -0,0 +1,270 @@
+from collections import Counter
+from contextlib import contextmanager
+
+import networkx as nx
+import numpy as np
+
+from stage_trace import NO_TRACE
+
+
+def _decrement(counts, key):
+    counts[key] -= 1
+    if counts[key] == 0:
+        del counts[key]
+        return True
+    return False
+
+
+class UnionFind(object):
+    """Disjoint sets of hashable nodes, merged with ``union``."""
+
+    def __init__(self, edges = ()):
+        self.parent = {}
+        self.size = {}
+        for u, v in edges:
+            self.union(u, v)
+
+    def find(self, node):
+        parent = self.parent
+        if node not in parent:
+            parent[node] = node
+            self.size[node] = 1
+            return node
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def union(self, u, v):
+        u, v = self.find(u), self.find(v)
+        if u == v:
+            return
+        if self.size[u] < self.size[v]:
+            u, v = v, u
+        self.parent[v] = u
+        self.size[u] += self.size.pop(v)
+
+    def labels(self, nodes):
+        """node -> component number, components numbered by their first node in ``nodes``.
+
+        That is the order ``nx.connected_components`` yields them in for a
+        graph whose nodes were inserted in the order of ``nodes``.
+        """
+        roots = {}
+        return {node : roots.setdefault(self.find(node), len(roots)) for node in nodes}
+
+
+class GraphState(object):
+    """Contact sets, chat degrees and chat graphs of a multiset of train rows.
+
+    Holds the same structures ``create_features`` derives from ``graph_df``
+    (``node1_contacts``/``node2_contacts``, ``node1_connections``/
+    ``node2_connections`` and the directed and undirected chat graphs), but
+    keeps per-edge row counts so rows can be removed and added back without
+    rebuilding anything.
+
+    It also keeps the row count of every node (``node1_rows``/
+    ``node2_rows``), union-find components of the undirected chat graph and,
+    per node1_id, the sums behind the reverse contact and reverse connection
+    features, so streamed rows update all of them in time proportional to the
+    rows and the degrees of their nodes.
+    """
+
+    def __init__(self, node1, node2, is_chat):
+        self.contact_rows = Counter()
+        self.chat_rows = Counter()
+        self.undirected_rows = Counter()
+        self.node1_rows = Counter()
+        self.node2_rows = Counter()
+        self.node1_contacts = {}
+        self.node2_contacts = {}
+        self.node1_connections = {}
+        self.node2_connections = {}
+        self.directed = nx.DiGraph()
+        self.undirected = nx.Graph()
+        # per node1_id: rows whose node2_id has contacts of its own, how many
+        # of those are contacted back, and how many rows are chatted back
+        self.reverse_contact_rows = Counter()
+        self.reverse_contact_sum = Counter()
+        self.reverse_connection_sum = Counter()
+        # union-find cannot split a component, so removing an edge drops it
+        # and the next use rebuilds it from the undirected graph
+        self._components = UnionFind()
+        # (node ids, values) of the last PageRank computed on this state, a
+        # warm start for the next fold's graph
+        self.last_pagerank = None
+        self.add(node1, node2, is_chat)
+
+    def add(self, node1, node2, is_chat):
+        for u, v, chat in zip(list(node1), list(node2), list(is_chat)):
+            reverse_rows = self.contact_rows[v, u]
+            if u not in self.node1_contacts:
+                # the rows into u stop being rows to a node without contacts
+                for x in self.node2_contacts.get(u, ()):
+                    self.reverse_contact_rows[x] += self.contact_rows[x, u]
+            self.node1_rows[u] += 1
+            self.node2_rows[v] += 1
+            self.contact_rows[u, v] += 1
+            if self.contact_rows[u, v] == 1:
+                self.node1_contacts.setdefault(u, set()).add(v)
+                self.node2_contacts.setdefault(v, set()).add(u)
+                self.reverse_contact_sum[v] += reverse_rows
+            if v in self.node1_contacts:
+                self.reverse_contact_rows[u] += 1
+                self.reverse_contact_sum[u] += self.contact_rows[v, u] > 0
+            if chat == 1:
+                self.node1_connections[u] = self.node1_connections.get(u, 0) + 1
+                self.node2_connections[v] = self.node2_connections.get(v, 0) + 1
+                self.chat_rows[u, v] += 1
+                if self.chat_rows[u, v] == 1:
+                    self.directed.add_edge(u, v)
+                    self.reverse_connection_sum[v] += self.contact_rows[v, u] - (u == v)
+                key = (u, v) if u <= v else (v, u)
+                self.undirected_rows[key] += 1
+                if self.undirected_rows[key] == 1:
+                    self.undirected.add_edge(u, v)
+                    if self._components is not None:
+                        self._components.union(u, v)
+            self.reverse_connection_sum[u] += self.chat_rows[v, u] > 0
+
+    def remove(self, node1, node2, is_chat):
+        for u, v, chat in zip(list(node1), list(node2), list(is_chat)):
+            self.reverse_connection_sum[u] -= self.chat_rows[v, u] > 0
+            if chat == 1:
+                _decrement(self.node1_connections, u)
+                _decrement(self.node2_connections, v)
+                if self.chat_rows[u, v] == 1:
+                    self.reverse_connection_sum[v] -= self.contact_rows[v, u] - (u == v)
+                if _decrement(self.chat_rows, (u, v)):
+                    self._remove_edge(self.directed, u, v)
+                if _decrement(self.undirected_rows, (u, v) if u <= v else (v, u)):
+                    self._remove_edge(self.undirected, u, v)
+                    self._components = None
+            if v in self.node1_contacts:
+                self.reverse_contact_rows[u] -= 1
+                self.reverse_contact_sum[u] -= self.contact_rows[v, u] > 0
+            if self.contact_rows[u, v] == 1:
+                self.reverse_contact_sum[v] -= self.contact_rows[v, u] - (u == v)
+            _decrement(self.node1_rows, u)
+            _decrement(self.node2_rows, v)
+            if _decrement(self.contact_rows, (u, v)):
+                for contacts, node, other in ((self.node1_contacts, u, v), (self.node2_contacts, v, u)):
+                    contacts[node].discard(other)
+                    if not contacts[node]:
+                        del contacts[node]
+            if u not in self.node1_contacts:
+                for x in self.node2_contacts.get(u, ()):
+                    self.reverse_contact_rows[x] -= self.contact_rows[x, u]
+
+    @staticmethod
+    def _remove_edge(graph, u, v):
+        graph.remove_edge(u, v)
+        # a graph built edge by edge only knows nodes that still have an edge
+        for node in (u, v):
+            if node in graph and graph.degree(node) == 0:
+                graph.remove_node(node)
+
+    @contextmanager
+    def without(self, node1, node2, is_chat, trace = NO_TRACE):
+        """Temporarily take the given rows out of the state.
+
+        Taking them out and putting them back are the ``hold_out`` and
+        ``restore`` stages of ``trace``.
+        """
+        with trace.stage('hold_out', edges = len(node1)):
+            self.remove(node1, node2, is_chat)
+        try:
+            yield self
+        finally:
+            with trace.stage('restore', edges = len(node1)):
+                self.add(node1, node2, is_chat)
+
+    def ordered_graphs(self, nodes):
+        """Copies of the chat graphs whose nodes are listed in the given order.
+
+        networkx results such as PageRank and component numbering depend on
+        node insertion order, so the copies use the order in which a fresh
+        edge-by-edge build would have met the nodes.
+        """
+        directed = nx.DiGraph()
+        directed.add_nodes_from(nodes)
+        directed.add_edges_from(self.directed.edges())
+        undirected = nx.Graph()
+        undirected.add_nodes_from(nodes)
+        undirected.add_edges_from(self.undirected.edges())
+        return directed, undirected
+
+    @property
+    def components(self):
+        """Union-find over the undirected chat edges."""
+        if self._components is None:
+            self._components = UnionFind(self.undirected.edges())
+        return self._components
+
+    def component_chat_rates(self, labels):
+        """Chat rate of the rows whose node1_id, and of those whose node2_id, lies in each component.
+
+        ``labels`` maps nodes to component numbers; components without such
+        rows are left out.
+        """
+        rates = []
+        for node_rows, connections in ((self.node1_rows, self.node1_connections), (self.node2_rows, self.node2_connections)):
+            rows, chats = Counter(), Counter()
+            for node, component in labels.items():
+                rows[component] += node_rows[node]
+                chats[component] += connections.get(node, 0)
+            rates.append({component : chats[component] / count for component, count in rows.items() if count})
+        return rates
+
+    def reverse_contact_stats(self):
+        """Per node1_id, the number and fraction of its contacts that contact it back.
+
+        Rows to a node2_id without contacts of its own do not count, and
+        node1_ids with only such rows are left out, as in create_features.
+        """
+        rows = self.reverse_contact_rows
+        num = {node : self.reverse_contact_sum[node] for node, count in rows.items() if count > 0}
+        return num, {node : total / rows[node] for node, total in num.items()}
+
+    def reverse_connection_stats(self):
+        """Per node1_id, the number and fraction of its contact rows whose reverse is a chat."""
+        num = {node : self.reverse_connection_sum[node] for node in self.node1_rows}
+        return num, {node : total / self.node1_rows[node] for node, total in num.items()}
+
+    # Per-row lookups of the same statistics, for the sparse engine: they
+    # cost the rows looked up rather than a pass over every node.
+
+    def reverse_contact_exists(self, node1, node2):
+        """1 where node2 contacts node1, 0 where it does not and -1 where node2 has no contacts of its own."""
+        return np.array([(1 if self.contact_rows[v, u] else 0) if v in self.node1_contacts else -1
+                         for u, v in zip(node1, node2)], dtype = np.int64)
+
+    def reverse_connection_exists(self, node1, node2):
+        """Whether node2 chats with node1, for every pair."""
+        return np.array([self.chat_rows[v, u] > 0 for u, v in zip(node1, node2)], dtype = bool)
+
+    def reverse_stat_nodes(self, node1, node2):
+        """The nodes whose reverse_contact_values or reverse_connection_values adding these rows can change; call it before ``add``.
+
+        Those are the nodes of the rows and, for a node1_id without contacts
+        of its own so far, the nodes that contact it.
+        """
+        nodes = set(node1).union(node2)
+        for u in set(node1) - set(self.node1_contacts):
+            nodes.update(self.node2_contacts.get(u, ()))
+        return np.array(sorted(nodes), dtype = np.int64)
+
+    @staticmethod
+    def _sum_mean(sums, rows, nodes):
+        counts = np.array([rows[node] for node in nodes], dtype = np.float64)
+        num = np.array([sums[node] for node in nodes], dtype = np.float64)
+        num[counts == 0] = np.nan
+        return num, num / np.maximum(counts, 1)
+
+    def reverse_contact_values(self, nodes):
+        """Number and fraction of reverse_contact_stats for each node, NaN for nodes it leaves out."""
+        return self._sum_mean(self.reverse_contact_sum, self.reverse_contact_rows, nodes)
+
+    def reverse_connection_values(self, nodes):
+        """Number and fraction of reverse_connection_stats for each node, NaN for nodes without rows."""
+        return self._sum_mean(self.reverse_connection_sum, self.node1_rows, nodes)
@@ -0,0 +1,497 @@
+import argparse
+import copy
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from feature_groups import FoldContext, build_features, derived_user_features
+from graph_engine import NodeIndex, RowGroups, take_or_nan
+from graph_state import GraphState
+from prepare_data import count_nodes
+
+
+def _pair_frame(node1, node2):
+    return pd.DataFrame({'id' : np.arange(len(node1)), 'node1_id' : np.asarray(node1, dtype = np.int64),
+                         'node2_id' : np.asarray(node2, dtype = np.int64)})
+
+
+class PairFeatures(object):
+    """The sparse-engine feature rows of given pairs, gathered from per-node arrays.
+
+    Every column build_features takes from one node of a pair (counts,
+    reverse-edge statistics, component, clustering, PageRank, connections,
+    user features) is computed once for every node the context knows, plus
+    one slot for unknown nodes, into a (value, node) table whose rows are
+    named in ``NODE_VALUES``. A request then only gathers two columns of it
+    per pair and computes the pairwise columns (contact overlap, reverse
+    edges, common neighbours, paths and the per-request aggregates) on
+    arrays, without a DataFrame. Columns are keyed by their build_features
+    names and returned in the order of ``feature_names``, the columns of a
+    build_features frame; ``Scorer`` checks the values against
+    build_features on a sample of pairs whenever it builds one of these.
+
+    Holds references to the context's structures as they are now, so it is
+    replaced rather than updated when rows are added. With a state, the
+    reverse-edge statistics are looked up per node in Python; given the
+    ``previous`` PairFeatures of the context and the nodes the added rows
+    ``touched`` (``GraphState.reverse_stat_nodes``), only those nodes and
+    the nodes new to the context are looked up again and the rest are
+    copied over. The other rows come from arrays over the whole graph
+    (PageRank and the component labels change everywhere) and are
+    gathered again with numpy.
+    """
+
+    NODE_VALUES = ('reverse_contact_num', 'reverse_contact_mean', 'reverse_connection_num', 'reverse_connection_mean',
+                   'contacts_from', 'contacts_to', 'component', 'component_chat_mean1', 'component_chat_mean2', 'cluster_coef',
+                   'page_rank', 'avg_neighbors_directed', 'avg_neighbors_undirected', 'connection_from', 'connection_to')
+
+    def __init__(self, context, feature_names, previous = None, touched = ()):
+        self.sparse_graph = sparse_graph = context.sparse_graph
+        self.contacts = context.contacts
+        self.state = state = context.state
+        self.contact_index = None if state is not None else context.contact_index
+        self.chat_index = None if state is not None else context.chat_index
+        self.max_path_depth = context.options['max_path_depth']
+        user_index, user_table, self.names = context.user_feature_table
+        ids = np.union1d(np.union1d(context.node1_counts.index.values, context.node2_counts.index.values), user_index.ids)
+        self.index = NodeIndex(ids)
+        # the last slot is an id no table has, so unknown nodes (looked up
+        # as -1) gather exactly what the groups give a missing node
+        nodes = np.append(self.index.ids, self.index.ids.min() - 1 if len(ids) else 0)
+
+        if state is None:
+            reverse = [self.contact_index.gather(values, nodes) for values in list(context.reverse_contact_stats) + list(context.reverse_connection_stats)]
+        else:
+            reverse = np.empty((4, len(nodes)))
+            stale = np.ones(len(nodes), dtype = bool)
+            if previous is not None:
+                moved = self.index.lookup(previous.index.ids)
+                reverse[:, moved] = previous.values[:4, :-1]
+                stale[moved] = False
+                stale[self.index.lookup(np.asarray(touched, dtype = np.int64))] = True
+                stale[-1] = True
+            reverse[:, stale] = self._reverse_values(state, nodes[stale])
+        components, chat_mean1, chat_mean2 = context.component_stats
+        component = sparse_graph.gather(components, nodes)
+        pg_ranks, avg_neighbors, avg_neighbors_undirected = context.node_ranks
+        node1_connections, node2_connections = context.connections
+        self.values = np.vstack([
+            reverse[0], reverse[1], reverse[2], reverse[3],
+            context.node1_counts.reindex(nodes).values, context.node2_counts.reindex(nodes).values,
+            component, take_or_nan(chat_mean1, component), take_or_nan(chat_mean2, component),
+            sparse_graph.gather(context.clusters, nodes),
+            sparse_graph.gather(pg_ranks, nodes, -1), sparse_graph.gather(avg_neighbors, nodes, -1),
+            sparse_graph.gather(avg_neighbors_undirected, nodes, -1),
+            node1_connections.reindex(nodes).values, node2_connections.reindex(nodes).values]).astype(np.float64)
+        self.user_values = user_table[:, user_index.lookup(nodes)]
+        self.user_known = np.append(user_index.lookup(self.index.ids) >= 0, False)
+
+        self.feature_names = list(feature_names)
+        given = set(self.columns(nodes[-1:], nodes[-1:]))
+        if given != set(self.feature_names):
+            raise ValueError("PairFeatures gives {} where build_features gives {}".format(
+                sorted(given - set(self.feature_names)), sorted(set(self.feature_names) - given)))
+
+    @staticmethod
+    def _reverse_values(state, nodes):
+        contact_num, contact_mean = state.reverse_contact_values(nodes)
+        connection_num, connection_mean = state.reverse_connection_values(nodes)
+        # cast as the reverse_contacts group casts it
+        return contact_num, contact_mean.astype(np.float32).astype(np.float64), connection_num, connection_mean
+
+    def matrix(self, node1, node2):
+        """The feature columns of build_features (without id, node1_id and node2_id) as a float32 (pairs, features) array."""
+        columns = self.columns(node1, node2)
+        return np.column_stack([columns[name] for name in self.feature_names]).astype(np.float32)
+
+    def columns(self, node1, node2):
+        """The feature columns of the pairs by name, as the feature groups compute them."""
+        node1, node2 = np.asarray(node1, dtype = np.int64), np.asarray(node2, dtype = np.int64)
+        position1, position2 = self.index.lookup(node1), self.index.lookup(node2)
+        a = dict(zip(self.NODE_VALUES, self.values[:, position1]))
+        b = dict(zip(self.NODE_VALUES, self.values[:, position2]))
+        by_node1, by_node2 = RowGroups(node1), RowGroups(node2)
+        c = {}
+
+        # counts
+        c['num_contacts_from_node1'], c['num_contacts_from_node2'] = a['contacts_from'], b['contacts_from']
+        c['num_contacts_to_node1'], c['num_contacts_to_node2'] = a['contacts_to'], b['contacts_to']
+        c['contacts_from_count'] = a['contacts_from'] + b['contacts_from']
+        c['contacts_to_count'] = a['contacts_to'] + b['contacts_to']
+        c['node_count_from_diff_abs'] = np.abs(a['contacts_from'] - b['contacts_from'])
+        c['node_count_from_diff'] = a['contacts_from'] - b['contacts_from']
+        c['node_count_to_from_diff_abs'] = np.abs(a['contacts_to'] - b['contacts_to'])
+        c['node_count_to_diff'] = a['contacts_to'] - b['contacts_to']
+
+        (c['common_contacts_from'], c['common_contacts_to'],
+         c['common_contacts_from_ratio'], c['common_contacts_to_ratio']) = self._contact_overlap(node1, node2)
+
+        # reverse_contacts and same_node
+        if self.state is not None:
+            c['reverse_contact_exists'] = self.state.reverse_contact_exists(node1, node2)
+            c['reverse_connection_exists'] = self.state.reverse_connection_exists(node1, node2)
+        else:
+            c['reverse_contact_exists'] = self.contact_index.reverse_contact_exists(node1, node2)
+            c['reverse_connection_exists'] = self.chat_index.reverse_exists(node1, node2)
+        c['num_contacts_with_reverse_contacts1'], c['num_contacts_with_reverse_contacts2'] = a['reverse_contact_num'], b['reverse_contact_num']
+        c['mean_contacts_with_reverse_contacts1'], c['mean_contacts_with_reverse_contacts2'] = a['reverse_contact_mean'], b['reverse_contact_mean']
+        c['same_node'] = node1 == node2
+
+        # components and clustering
+        c['node1_connected_component'], c['node2_connected_component'] = a['component'], b['component']
+        c['same_connected_component'] = a['component'] == b['component']
+        c['node1_connected_component_count'] = by_node1.aggregate(a['component'])[0][:, 0]
+        c['node2_connected_component_count'] = by_node2.aggregate(b['component'])[0][:, 0]
+        c['connected_component_count_diff'] = c['node1_connected_component_count'] - c['node2_connected_component_count']
+        c['connected_component_is_chat_mean1'], c['connected_component_is_chat_mean2'] = a['component_chat_mean1'], b['component_chat_mean2']
+        c['node1_cluster_coef'], c['node2_cluster_coef'] = a['cluster_coef'], b['cluster_coef']
+        c['cluster_coef_diff'] = a['cluster_coef'] - b['cluster_coef']
+
+        # reverse_connections; max(1, x) is 1 for NaN, and so is fmax
+        c['num_connections_with_reverse_contacts1'], c['num_connections_with_reverse_contacts2'] = a['reverse_connection_num'], b['reverse_connection_num']
+        c['mean_connections_with_reverse_contacts1'], c['mean_connections_with_reverse_contacts2'] = a['reverse_connection_mean'], b['reverse_connection_mean']
+        c['reversed_conection_to_contact_ratio1'] = a['reverse_connection_num'] / np.fmax(1, a['reverse_contact_num'])
+        c['reversed_conection_to_contact_ratio2'] = b['reverse_connection_num'] / np.fmax(1, b['reverse_contact_num'])
+
+        # pagerank
+        c['page_rank_1'], c['page_rank_2'] = a['page_rank'], b['page_rank']
+        c['avg_neighbors_1_directed'], c['avg_neighbors_2_directed'] = a['avg_neighbors_directed'], b['avg_neighbors_directed']
+        c['avg_neighbors_1_undirected'], c['avg_neighbors_2_undirected'] = a['avg_neighbors_undirected'], b['avg_neighbors_undirected']
+        c['page_rank_diff'] = a['page_rank'] - b['page_rank']
+        c['avg_neighbors_directed_diff'] = a['avg_neighbors_directed'] - b['avg_neighbors_directed']
+        c['avg_neighbors_undirected_diff'] = a['avg_neighbors_undirected'] - b['avg_neighbors_undirected']
+
+        # count_means
+        node1_means = by_node1.aggregate(a['contacts_to'])[2]
+        node2_means = by_node2.aggregate(b['contacts_from'], b['contacts_to'])[2]
+        c['avg_node2_from_count'], c['avg_node1_from_count'] = node1_means[:, 0], node2_means[:, 0]
+        c['avg_node2_to_count'], c['avg_node1_to_count'] = node1_means[:, 0], node2_means[:, 1]
+
+        # connections
+        c['node1_connection_from_count'], c['node2_connection_from_count'] = a['connection_from'], b['connection_from']
+        c['node1_connection_to_count'], c['node2_connection_to_count'] = a['connection_to'], b['connection_to']
+        c['node_connection_from_sum'] = a['connection_from'] + b['connection_from']
+        c['node_connection_to_sum'] = a['connection_to'] + b['connection_to']
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            c['node1_connection_from_percentage'] = a['connection_from'] / a['contacts_from']
+            c['node2_connection_from_percentage'] = b['connection_from'] / b['contacts_from']
+            c['node1_connection_to_percentage'] = a['connection_to'] / a['contacts_to']
+            c['node2_connection_to_percentage'] = b['connection_to'] / b['contacts_to']
+        c['node_connection_from_diff'] = a['connection_from'] - b['connection_from']
+        c['node_connection_to_diff'] = a['connection_to'] - b['connection_to']
+        node1_means = by_node1.aggregate(b['connection_from'], b['connection_to'])[2]
+        node2_means = by_node2.aggregate(a['connection_from'], a['connection_to'])[2]
+        c['avg_node2_connection_from_count'], c['avg_node1_connection_from_count'] = node1_means[:, 0], node2_means[:, 0]
+        c['avg_node2_connection_to_count'], c['avg_node1_connection_to_count'] = node1_means[:, 1], node2_means[:, 1]
+
+        # common_neighbors and shortest_paths
+        sparse_graph = self.sparse_graph
+        c['num_common_neighbors_directed'], c['common_neighbors_similarity_directed'] = sparse_graph.common_neighbors(node1, node2, directed = True)
+        c['num_common_neighbors_undirected'], c['common_neighbors_similarity_undirected'] = sparse_graph.common_neighbors(node1, node2, directed = False)
+        c['shortest_path_length_directed'] = sparse_graph.shortest_path_lengths(node1, node2, directed = True, max_depth = self.max_path_depth)
+        c['shortest_path_length_undirected'] = sparse_graph.shortest_path_lengths(node1, node2, directed = False, max_depth = self.max_path_depth)
+
+        # the user_features group fills the gaps of every earlier column
+        for name, values in c.items():
+            values = np.asarray(values, dtype = np.float64)
+            values[np.isnan(values)] = -1
+            c[name] = values
+
+        x, y = self.user_values[:, position1], self.user_values[:, position2]
+        if not (self.user_known[position1].all() and self.user_known[position2].all()):
+            x, y = x.astype(np.float64), y.astype(np.float64)
+        for k, name in enumerate(self.names):
+            c[name + '_x'], c[name + '_y'] = x[k], y[k]
+        c.update(derived_user_features(x, y, self.names))
+        return c
+
+    def _contact_overlap(self, node1, node2):
+        node1_contacts, node2_contacts = self.contacts
+        columns = np.empty((4, len(node1)))
+        for k, (u, v) in enumerate(zip(node1.tolist(), node2.tolist())):
+            for j, contacts in enumerate((node1_contacts, node2_contacts)):
+                if u in contacts and v in contacts:
+                    common = len(contacts[u].intersection(contacts[v]))
+                    columns[j, k], columns[j + 2, k] = common, common / max(1, len(contacts[u].union(contacts[v])))
+                else:
+                    columns[j, k] = columns[j + 2, k] = -1
+        return list(columns)
+
+
+class ReadWriteLock(object):
+    """Any number of readers at a time, or one writer; a waiting writer keeps new readers out."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writers = 0
+        self._writing = False
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writers -= 1
+                self._writing = False
+                self._condition.notify_all()
+
+
+def sample_pairs(node1, node2, size = 100, seed = 0):
+    """A random sample of the pairs, followed by the same pairs reversed and by the self pairs of their node1_ids."""
+    rows = np.random.RandomState(seed).permutation(len(node1))[:size]
+    node1, node2 = np.asarray(node1, dtype = np.int64)[rows], np.asarray(node2, dtype = np.int64)[rows]
+    return np.concatenate([node1, node2, node1]), np.concatenate([node2, node1, node1])
+
+
+class Scorer(object):
+    """Scores (node1_id, node2_id) pairs with the model train.py saved.
+
+    The graph structures of the whole training set (the graph the test
+    features are built on) and the model are loaded once; a request only
+    looks its pairs up in them, through ``PairFeatures`` with the sparse
+    engine. Every feature is computed exactly as create_features computes
+    it for test.csv, which means the few per-frame aggregates
+    (``avg_node*_count``, ``avg_node*_connection_*_count`` and
+    ``node*_connected_component_count``) are taken over the pairs of the
+    request.
+
+    With ``incremental = True`` the training rows are also held in a
+    GraphState, and ``update`` adds new rows to it and to the structures
+    built on it in place. Requests hold ``lock`` for reading and updates
+    for writing, so a request sees the structures either before or after
+    an update, never in between.
+    """
+
+    def __init__(self, model_file = "./model.txt", data_dir = "../Data", engine = 'sparse', max_path_depth = None, incremental = False,
+                 warm_pagerank = False):
+        self.train = pd.read_csv("{}/train.csv".format(data_dir))
+        self.test = pd.read_csv("{}/test.csv".format(data_dir))
+        self.user_features = pd.read_csv("{}/user_features.csv".format(data_dir))
+        self.state = GraphState(self.train.node1_id.values, self.train.node2_id.values, self.train.is_chat.values) if incremental else None
+        self.model = lgb.Booster(model_file = model_file)
+        self.lock = ReadWriteLock()
+        # unknown nodes leave gaps in columns the compact schema keeps as
+        # integers; train.py hands float32 to LightGBM in any case
+        self.context = FoldContext(-1, self.train, self.test, self.user_features, None, count_nodes(self.train, self.test),
+                                   state = self.state, compact_dtypes = False, engine = engine, max_path_depth = max_path_depth,
+                                   warm_pagerank = warm_pagerank)
+        node1, node2 = sample_pairs(self.train.node1_id.values, self.train.node2_id.values)
+        test1, test2 = sample_pairs(self.test.node1_id.values, self.test.node2_id.values)
+        self._pairs = self._build(np.append(node1, test1), np.append(node2, test2))
+        if engine == 'sparse' and self._pairs is None:
+            raise ValueError("PairFeatures does not give the columns build_features gives")
+
+    def _build(self, node1, node2, previous = None, touched = ()):
+        """Builds every graph structure now rather than in the first requests.
+
+        Features of the given pairs, and of pairs with a node the graph has
+        never seen, are built on the context itself, so the structures stay
+        there. With the sparse engine, returns a ``PairFeatures`` (refreshed
+        from ``previous`` for the ``touched`` nodes) if it gives the same
+        features for these pairs, None otherwise.
+        """
+        unknown = min(self.train.node1_id.min(), self.train.node2_id.min(), self.test.node1_id.min(), self.test.node2_id.min()) - 1
+        node1 = np.append(np.asarray(node1, dtype = np.int64), [node1[0], unknown, unknown])
+        node2 = np.append(np.asarray(node2, dtype = np.int64), [unknown, node2[0], unknown])
+        df = build_features(self.context, df = _pair_frame(node1, node2))
+        X = df[df.columns[3:]].values.astype(np.float32)
+        if X.shape[1] != self.model.num_feature():
+            raise ValueError("the model expects {} features, the feature groups give {}".format(self.model.num_feature(), X.shape[1]))
+        if self.context.options['engine'] != 'sparse':
+            return None
+        pairs = PairFeatures(self.context, df.columns[3:], previous, touched)
+        if not np.array_equal(pairs.matrix(node1, node2), X, equal_nan = True):
+            return None
+        return pairs
+
+    def features(self, node1, node2):
+        """The frame build_features gives for the pairs."""
+        with self.lock.reading():
+            return self._features(node1, node2)
+
+    def _features(self, node1, node2):
+        # on a shallow copy of the context, whose set_rows leaves the shared
+        # context alone; _build has built every structure on the context
+        return build_features(copy.copy(self.context), df = _pair_frame(node1, node2))
+
+    def score(self, node1, node2):
+        """is_chat probabilities of the pairs node1[k], node2[k].
+
+        With the sparse engine the features come from ``PairFeatures``,
+        otherwise from build_features.
+        """
+        with self.lock.reading():
+            pairs = self._pairs
+            if pairs is not None:
+                X = pairs.matrix(node1, node2)
+            else:
+                df = self._features(node1, node2)
+                X = df[df.columns[3:]].values.astype(np.float32)
+        return self.model.predict(X, num_threads = 1)
+
+    def update(self, node1, node2, is_chat):
+        """Adds training rows; every later score sees them.
+
+        See ``FoldContext.add_rows``: with the sparse engine, the node and
+        chat counts, contact sets, reverse-edge sums, CSR graph, triangle
+        counts and per-node row counts are updated in place, and only
+        PageRank (warm-started from the previous one with ``warm_pagerank``), the neighbour degrees
+        and the component labels are computed again from the CSR arrays.
+        With the networkx engine the graphs are built again. ``train`` keeps
+        the rows the scorer was loaded with.
+
+        The PairFeatures of the previous graph is refreshed for the nodes the
+        rows touch, checked on a sample of the new rows, their reverses and
+        self pairs, and published with one assignment; should it differ from
+        build_features, the scorer warns and scores through build_features
+        until an update gives one that matches.
+        """
+        if self.state is None:
+            raise ValueError("the scorer was built without incremental = True")
+        rows = pd.DataFrame({'node1_id' : np.asarray(node1, dtype = np.int64), 'node2_id' : np.asarray(node2, dtype = np.int64),
+                             'is_chat' : np.asarray(is_chat, dtype = np.int64)})
+        if not len(rows):
+            return
+        if not rows.is_chat.isin((0, 1)).all():
+            raise ValueError("is_chat must be 0 or 1")
+        node1, node2 = sample_pairs(rows.node1_id.values, rows.node2_id.values, size = 20)
+        with self.lock.writing():
+            previous, self._pairs = self._pairs, None
+            touched = self.state.reverse_stat_nodes(rows.node1_id.values, rows.node2_id.values)
+            self.context.add_rows(rows)
+            self._pairs = self._build(node1, node2, previous, touched)
+            if self._pairs is None and self.context.options['engine'] == 'sparse':
+                print("Warning: PairFeatures differs from build_features after the update, scoring through build_features")
+
+
+def serve(scorer, port = 8000):
+    """HTTP server scoring ``{"node1_id": [...], "node2_id": [...]}`` POSTs.
+
+    The response is ``{"is_chat": [...]}``. POSTs to ``/update`` with an
+    ``is_chat`` list as well add training rows to an incremental scorer.
+    Call ``serve_forever()`` on the result.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path.rstrip('/') == '/update':
+                    scorer.update(request['node1_id'], request['node2_id'], request['is_chat'])
+                    body, status = {'rows' : len(request['node1_id'])}, 200
+                else:
+                    body, status = {'is_chat' : scorer.score(request['node1_id'], request['node2_id']).tolist()}, 200
+            except (ValueError, KeyError, TypeError) as e:
+                body, status = {'error' : str(e)}, 400
+            body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+
+def http_client(url):
+    def score(node1, node2):
+        request = Request(url, data = json.dumps({'node1_id' : [int(n) for n in node1], 'node2_id' : [int(n) for n in node2]}).encode(),
+                          headers = {'Content-Type' : 'application/json'})
+        with urlopen(request) as response:
+            return np.array(json.loads(response.read())['is_chat'])
+    return score
+
+
+def benchmark(score, node1, node2, requests = 1000, batch_size = 1, seed = 0):
+    """Times ``requests`` calls of ``score`` on random batches of the given pairs."""
+    rng = np.random.RandomState(seed)
+    latencies = np.empty(requests)
+    start = time.perf_counter()
+    for k in range(requests):
+        rows = rng.randint(len(node1), size = batch_size)
+        t = time.perf_counter()
+        score(node1[rows], node2[rows])
+        latencies[k] = time.perf_counter() - t
+    total = time.perf_counter() - start
+    print("{} requests of {} pairs in {:.2f} s: {:.0f} requests/s, {:.0f} pairs/s, latency p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+        requests, batch_size, total, requests / total, requests * batch_size / total,
+        np.percentile(latencies, 50) * 1e3, np.percentile(latencies, 99) * 1e3, latencies.max() * 1e3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default = "./model.txt", help = 'model file written by train.py')
+    parser.add_argument('--engine', choices = ['networkx', 'sparse'], default = 'sparse',
+                        help = 'backend for the graph features')
+    parser.add_argument('--max-path-depth', type = int, default = None,
+                        help = 'with --engine sparse, give up on shortest paths longer than this many hops')
+    parser.add_argument('--serve', type = int, metavar = 'PORT', default = None,
+                        help = 'answer scoring requests over HTTP on this port')
+    parser.add_argument('--benchmark', type = int, metavar = 'REQUESTS', default = None,
+                        help = 'time this many requests on random pairs of test.csv')
+    parser.add_argument('--batch-size', type = int, default = 1, help = 'pairs per benchmark request')
+    parser.add_argument('--http', action = 'store_true',
+                        help = 'send the benchmark requests to a local HTTP server instead of calling the scorer directly')
+    parser.add_argument('--incremental', action = 'store_true',
+                        help = 'keep the training rows in an updatable graph state, so rows can be POSTed to /update')
+    parser.add_argument('--warm-pagerank', action = 'store_true',
+                        help = 'with --incremental, start PageRank after an update from the previous one; faster, but off by up to about 1%%')
+    parser.add_argument('--update-rows', type = int, default = None,
+                        help = 'with --incremental, time an update with this many random rows before anything else')
+    args = parser.parse_args()
+    if args.serve is None and args.benchmark is None and args.update_rows is None:
+        parser.error('give --serve, --benchmark or --update-rows')
+    if args.update_rows and not args.incremental:
+        parser.error('--update-rows needs --incremental')
+
+    start_time = time.time()
+    scorer = Scorer(args.model, engine = args.engine, max_path_depth = args.max_path_depth, incremental = args.incremental,
+                    warm_pagerank = args.warm_pagerank)
+    print("Scorer loaded in", time.time() - start_time)
+    if args.update_rows:
+        rng = np.random.RandomState(0)
+        nodes = np.union1d(scorer.train.node1_id.values, scorer.train.node2_id.values)
+        start_time = time.time()
+        scorer.update(rng.choice(nodes, args.update_rows), rng.choice(nodes, args.update_rows),
+                      rng.binomial(1, scorer.train.is_chat.mean(), args.update_rows))
+        print("Update of {} rows took {:.2f} s".format(args.update_rows, time.time() - start_time))
+    if args.benchmark:
+        test = pd.read_csv("../Data/test.csv")
+        score = scorer.score
+        if args.http:
+            server = serve(scorer, 0)
+            threading.Thread(target = server.serve_forever, daemon = True).start()
+            score = http_client("http://127.0.0.1:{}/".format(server.server_address[1]))
+        benchmark(score, test.node1_id.values, test.node2_id.values, args.benchmark, args.batch_size)
+    if args.serve is not None:
+        serve(scorer, args.serve).serve_forever()
@@ -0,0 +1,66 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+class SharedFrame(object):
+    """A DataFrame copied once into a shared-memory block.
+
+    The columns are stored column-major under a common dtype, so a frame
+    whose columns all share one dtype (like train, test and user_features)
+    is rebuilt in another process as a view on the block without copying.
+    Frames with mixed dtypes are cast back column by column, which copies.
+    Instances pickle as the block name plus layout, so they can be passed to
+    pool initializers.
+    """
+
+    def __init__(self, frame):
+        self.columns = list(frame.columns)
+        self.dtypes = list(frame.dtypes)
+        self.dtype = np.result_type(*self.dtypes)
+        self.shape = (len(self.columns), frame.shape[0])
+        self._shm = shared_memory.SharedMemory(create = True, size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize))
+        self.name = self._shm.name
+        values = np.ndarray(self.shape, dtype = self.dtype, buffer = self._shm.buf)
+        for j, column in enumerate(self.columns):
+            values[j] = frame[column].values
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shm'] = None
+        return state
+
+    def attach(self):
+        """Returns the frame as a view on the shared block."""
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name = self.name)
+        values = np.ndarray(self.shape, dtype = self.dtype, buffer = self._shm.buf)
+        frame = pd.DataFrame(values.T, columns = self.columns, copy = False)
+        if any(dtype != self.dtype for dtype in self.dtypes):
+            frame = frame.astype(dict(zip(self.columns, self.dtypes)))
+        return frame
+
+    def release(self):
+        """Closes and removes the block; call once in the creating process."""
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedArray(object):
+    """A numpy array copied once into a shared-memory block."""
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shape, self.dtype = array.shape, array.dtype
+        self._shm = shared_memory.SharedMemory(create = True, size = max(1, array.nbytes))
+        self.name = self._shm.name
+        np.ndarray(self.shape, dtype = self.dtype, buffer = self._shm.buf)[...] = array
+
+    __getstate__ = SharedFrame.__getstate__
+    release = SharedFrame.release
+
+    def attach(self):
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name = self.name)
+        return np.ndarray(self.shape, dtype = self.dtype, buffer = self._shm.buf)
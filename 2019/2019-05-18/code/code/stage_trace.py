@@ -0,0 +1,91 @@
+import json
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_PAGE_MB = os.sysconf('SC_PAGE_SIZE') / 1024.0 ** 2
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def rss_mb():
+    """Current resident set size, None where /proc is missing."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except OSError:
+        return None
+
+
+class StageTrace(object):
+    """Wall time and memory of the stages of one run, written as JSON.
+
+    ``with trace.stage('graphs', edges = n) as record:`` appends a record
+    with the stage's seconds, the RSS at its end, how far it raised the
+    process's peak RSS and, while tracemalloc is tracing, the peak of the
+    memory allocated during it. Counts passed in, or set on ``record``
+    inside the block, are kept as they are. Stages nest: a record names the
+    stage it ran in as ``parent``, and the parent's figures include it.
+
+    A disabled trace records nothing, so code can be instrumented
+    unconditionally; ``NO_TRACE`` is the shared disabled one.
+    """
+
+    def __init__(self, path = None, enabled = True, **info):
+        self.path = path
+        self.enabled = enabled
+        self.info = info
+        self.records = []
+        self._stack = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, **counts):
+        if not self.enabled:
+            yield counts
+            return
+        record = dict(stage = name, parent = self._stack[-1][0]['stage'] if self._stack else None, **counts)
+        self.records.append(record)
+        traced = None
+        if tracemalloc.is_tracing():
+            traced, peak = tracemalloc.get_traced_memory()
+            # the enclosing stage keeps the peak seen so far before it is reset
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], peak)
+            tracemalloc.reset_peak()
+        frame = [record, traced, traced]
+        self._stack.append(frame)
+        peak_rss = peak_rss_mb()
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start_time
+            record['rss_mb'] = rss_mb()
+            record['peak_rss_delta_mb'] = peak_rss_mb() - peak_rss
+            self._stack.pop()
+            if traced is not None and tracemalloc.is_tracing():
+                peak = max(frame[2], tracemalloc.get_traced_memory()[1])
+                record['traced_peak_mb'] = (peak - traced) / 1024.0 ** 2
+                if self._stack:
+                    self._stack[-1][2] = max(self._stack[-1][2], peak)
+
+    def write(self):
+        """Writes the records to ``path``, if the trace is enabled and has one."""
+        if not self.enabled or self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok = True)
+        trace = dict(self.info, pid = os.getpid(), seconds = time.perf_counter() - self._start,
+                     peak_rss_mb = peak_rss_mb(), stages = self.records)
+        with open(self.path, 'w') as f:
+            # counts may be numpy integers
+            json.dump(trace, f, indent = 1, default = lambda value: value.item())
+
+
+NO_TRACE = StageTrace(enabled = False)
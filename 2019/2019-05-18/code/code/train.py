@@ -1,12 +1,47 @@
 import pandas as pd
 import numpy as np
 import lightgbm as lgb
+import argparse
+import os
+import resource
+import sys
+from batch_predict import predict_to_csv, test_chunks
+from cv_search import configurations, cross_validate, parse_grid, ranked_table
+from feature_store import ColumnStore, read_column, read_matrix, store_dataset
+from stage_trace import NO_TRACE, StageTrace
 
-dev = pd.concat([pd.read_csv("../Data/train_features_fold_{}.csv".format(i)) for i in range(9)]).reset_index(drop = True)
-val = pd.read_csv("../Data/train_features_fold_9.csv")
-test = pd.read_csv("../Data/test_features.csv")
+parser = argparse.ArgumentParser()
+parser.add_argument('--format', choices = ['csv', 'npy'], default = 'csv',
+                    help = 'format prepare_data.py wrote the features in')
+parser.add_argument('--out-of-core', action = 'store_true',
+                    help = 'with --format npy, build the LightGBM datasets batch by batch from the fold files')
+parser.add_argument('--deterministic', action = 'store_true',
+                    help = 'train with col-wise histograms in LightGBM\'s deterministic mode, so reruns give the same model')
+parser.add_argument('--dataset-cache', default = None,
+                    help = 'directory to save the binned LightGBM datasets in, and to load them from on later runs')
+parser.add_argument('--trace', default = None,
+                    help = 'write the time, RSS and row counts of every stage as JSON to this file')
+parser.add_argument('--chunk-rows', type = int, default = 100000,
+                    help = 'test rows read and predicted at a time while the submission is written')
+parser.add_argument('--predict-threads', type = int, default = 0,
+                    help = 'threads for predicting the test set, 0 for the LightGBM default')
+parser.add_argument('--search', nargs = '+', metavar = 'NAME=VALUES', default = None,
+                    help = 'instead of training the model, run 10-fold CV on every combination of these parameter values, '
+                           'e.g. --search num_leaves=63,255,500 learning_rate=0.0175,0.05')
+parser.add_argument('--jobs', type = int, default = 2, help = 'with --search, configurations trained at the same time')
+parser.add_argument('--search-out', default = "./search.csv", help = 'with --search, where the ranked table is written')
+args = parser.parse_args()
+if args.out_of_core and args.format != 'npy':
+    parser.error('--out-of-core needs --format npy')
+if args.search:
+    try:
+        grid = parse_grid(args.search)
+    except ValueError as e:
+        parser.error(str(e))
+trace = StageTrace(args.trace, format = args.format, out_of_core = args.out_of_core, deterministic = args.deterministic) if args.trace else NO_TRACE
 
-indep_vars = list(dev.columns)[3:]
+def peak_rss_gb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 ** 2
 
 params = {
     'task': 'train',
@@ -26,16 +61,107 @@ params = {
     'min_gain_to_split' : 0.05,
     'min_sum_hessian_in_leaf': 12.0
 }
+if args.deterministic:
+    # LightGBM otherwise picks col-wise or row-wise histograms by timing both
+    # on every run and sums them over threads in no fixed order, so two runs
+    # on the same binned data can grow different trees
+    params.update(force_col_wise = True, deterministic = True)
 
+if args.format == 'npy':
+    dev = [ColumnStore("../Data/train_features_fold_{}".format(i)) for i in range(9)]
+    val = [ColumnStore("../Data/train_features_fold_9")]
+    indep_vars = dev[0].columns[3:]
+else:
+    indep_vars = list(pd.read_csv("../Data/train_features_fold_0.csv", nrows = 0).columns)[3:]
 
-lgb_dev = lgb.Dataset(dev[indep_vars].values.astype(np.float32), dev['is_chat'] )
-lgb_val = lgb.Dataset(val[indep_vars].values.astype(np.float32), val['is_chat'] )
+if args.search:
+    # all ten folds binned once, fold after fold; cross_validate takes each
+    # fold's training and validation rows out of it
+    search_params = dict(params, feature_pre_filter = False)
+    search_cache = os.path.join(args.dataset_cache, 'cv.bin') if args.dataset_cache else None
+    if args.format == 'npy':
+        stores = dev + val
+        fold_sizes = [len(store) for store in stores]
+    else:
+        stores = [pd.read_csv("../Data/train_features_fold_{}.csv".format(i)) for i in range(10)]
+        fold_sizes = [len(fold) for fold in stores]
+    with trace.stage('load', rows = sum(fold_sizes), cached = search_cache is not None and os.path.exists(search_cache)) as record:
+        if record['cached']:
+            lgb_all = lgb.Dataset(search_cache, params = search_params)
+        elif args.out_of_core:
+            lgb_all = store_dataset(stores, indep_vars, 'is_chat', search_params)
+        elif args.format == 'npy':
+            lgb_all = lgb.Dataset(read_matrix(stores, indep_vars), read_column(stores, 'is_chat'), params = search_params)
+        else:
+            stores = pd.concat(stores).reset_index(drop = True)
+            lgb_all = lgb.Dataset(stores[indep_vars].values.astype(np.float32), stores['is_chat'], params = search_params)
+        del stores
+    with trace.stage('bin', rows = sum(fold_sizes)):
+        lgb_all.construct()
+        if search_cache and not os.path.exists(search_cache):
+            if not os.path.isdir(args.dataset_cache):
+                os.makedirs(args.dataset_cache)
+            lgb_all.save_binary(search_cache)
+    print("Peak RSS after building the dataset: {:.2f} GB".format(peak_rss_gb()))
 
-model = lgb.train(params, lgb_dev, num_boost_round = 5000, valid_sets = (lgb_dev, lgb_val),early_stopping_rounds = 200,
-             verbose_eval = 10)
+    configs = configurations(search_params, grid)
+    with trace.stage('search', rows = sum(fold_sizes), configurations = len(configs), jobs = args.jobs):
+        results = cross_validate(configs, lgb_all, fold_sizes, args.jobs)
+    table = ranked_table(configs, results, list(grid))
+    print(table.to_string(index = False))
+    table.to_csv(args.search_out, index = False)
+    trace.write()
+    print("Peak RSS: {:.2f} GB".format(peak_rss_gb()))
+    sys.exit()
 
+if args.dataset_cache:
+    dev_cache = os.path.join(args.dataset_cache, 'dev.bin')
+    val_cache = os.path.join(args.dataset_cache, 'val.bin')
+    cached = os.path.exists(dev_cache) and os.path.exists(val_cache)
+else:
+    cached = False
 
-pred = model.predict(test[indep_vars].values.astype(np.float32))
-test['is_chat'] = pred
-test['is_chat'] = test['is_chat']
-test[['id', 'is_chat']].to_csv("./submission.csv", index = False)
\ No newline at end of file
+with trace.stage('load', cached = cached):
+    if cached:
+        lgb_dev = lgb.Dataset(dev_cache, params = params)
+        lgb_val = lgb.Dataset(val_cache, reference = lgb_dev, params = params)
+    elif args.out_of_core:
+        lgb_dev = store_dataset(dev, indep_vars, 'is_chat', params)
+        lgb_val = store_dataset(val, indep_vars, 'is_chat', params, reference = lgb_dev)
+    elif args.format == 'npy':
+        lgb_dev = lgb.Dataset(read_matrix(dev, indep_vars), read_column(dev, 'is_chat'), params = params)
+        lgb_val = lgb.Dataset(read_matrix(val, indep_vars), read_column(val, 'is_chat'), reference = lgb_dev, params = params)
+    else:
+        dev = pd.concat([pd.read_csv("../Data/train_features_fold_{}.csv".format(i)) for i in range(9)]).reset_index(drop = True)
+        val = pd.read_csv("../Data/train_features_fold_9.csv")
+        lgb_dev = lgb.Dataset(dev[indep_vars].values.astype(np.float32), dev['is_chat'], params = params)
+        lgb_val = lgb.Dataset(val[indep_vars].values.astype(np.float32), val['is_chat'], reference = lgb_dev, params = params)
+        del dev, val
+
+# constructed here rather than inside lgb.train, so binning is a stage of its own
+with trace.stage('bin') as record:
+    lgb_dev.construct()
+    lgb_val.construct()
+    record['rows'], record['val_rows'], record['features'] = lgb_dev.num_data(), lgb_val.num_data(), lgb_dev.num_feature()
+    if args.dataset_cache and not cached:
+        if not os.path.isdir(args.dataset_cache):
+            os.makedirs(args.dataset_cache)
+        lgb_dev.save_binary(dev_cache)
+        lgb_val.save_binary(val_cache)
+print("Peak RSS after building the datasets: {:.2f} GB".format(peak_rss_gb()))
+
+with trace.stage('train', rows = lgb_dev.num_data()) as record:
+    model = lgb.train(params, lgb_dev, num_boost_round = 5000, valid_sets = (lgb_dev, lgb_val),early_stopping_rounds = 200,
+                 verbose_eval = 10)
+    record['rounds'], record['best_iteration'] = model.current_iteration(), model.best_iteration
+model.save_model("./model.txt")
+
+
+# streamed chunk by chunk, so neither the test features nor the
+# predictions are ever held in memory as a whole
+with trace.stage('predict', chunk_rows = args.chunk_rows, threads = args.predict_threads) as record:
+    test_path = "../Data/test_features" if args.format == 'npy' else "../Data/test_features.csv"
+    record['rows'] = predict_to_csv(model, test_chunks(test_path, indep_vars, args.format, args.chunk_rows), "./submission.csv",
+                                    args.predict_threads)
+trace.write()
+print("Peak RSS: {:.2f} GB".format(peak_rss_gb()))
\ No newline at end of file
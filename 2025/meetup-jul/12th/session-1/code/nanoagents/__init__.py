@@ -1,2 +1,4 @@
 from nanoagents.nanoagent import Agent
 from nanoagents.nanoagent import Tool
+from nanoagents.nanoagent import RateLimiter
+from nanoagents.nanoagent import ResponseCache
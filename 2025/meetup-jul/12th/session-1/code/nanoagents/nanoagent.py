@@ -1,7 +1,19 @@
+import asyncio
+import hashlib
 import inspect
 import json
+import os
 import re
-from typing import Callable, Dict, List, Optional
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# thread pool sync llms and tools run on inside arun; run_many sizes one to its concurrency
+_executor: ContextVar[Optional[ThreadPoolExecutor]] = ContextVar('nanoagents_executor', default=None)
 
 
 def _parse_schema(func):
@@ -10,16 +22,183 @@ def _parse_schema(func):
             for n, p in inspect.signature(func).parameters.items() if n != 'self']
 
 
+def _is_async(func) -> bool:
+    return inspect.iscoroutinefunction(func) or inspect.iscoroutinefunction(getattr(func, '__call__', None))
+
+
+async def _acall(func: Callable, *args, **kwargs) -> Any:
+    """Await func, running it on a thread pool unless it is async."""
+    if _is_async(func):
+        return await func(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executor.get(), partial(func, *args, **kwargs))
+
+
+class RateLimiter:
+    """Allows at most `calls` LLM calls in any `period` seconds; share one between the agents of a provider."""
+
+    def __init__(self, calls: int, period: float = 1.0):
+        self.calls, self.period = calls, period
+        self._times: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a slot and return 0, or return how long to wait for the next one."""
+        with self._lock:
+            now = time.monotonic()
+            while self._times and now - self._times[0] >= self.period:
+                self._times.popleft()
+            if len(self._times) < self.calls:
+                self._times.append(now)
+                return 0
+            return self.period - (now - self._times[0])
+
+    def wait(self):
+        while delay := self._reserve():
+            time.sleep(delay)
+
+    async def await_slot(self):
+        while delay := self._reserve():
+            await asyncio.sleep(delay)
+
+
+class ResponseCache:
+    """LLM responses keyed by a hash of the prompt and model params: an in-memory LRU of `max_size` entries,
+    and, with a `path`, a directory of one JSON file per response that outlives the process."""
+
+    def __init__(self, max_size: int = 1024, path: str = None):
+        self.max_size, self.path = max_size, path
+        self.hits = self.misses = 0
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(prompt: str, params: dict = None) -> str:
+        return hashlib.sha256(json.dumps([prompt, params or {}], sort_keys=True, default=str).encode()).hexdigest()
+
+    def _file(self, key: str) -> str: return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if (response := self._entries.get(key)) is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+        if self.path and os.path.exists(file := self._file(key)):
+            with open(file) as f:
+                response = json.load(f)["response"]
+            self._remember(key, response)
+            with self._lock:
+                self.hits += 1
+            return response
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, response: str):
+        self._remember(key, response)
+        if self.path:
+            tmp = f"{self._file(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"response": response}, f)
+            os.replace(tmp, self._file(key))
+
+    def _remember(self, key: str, response: str):
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        calls = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / calls if calls else 0.0,
+                "size": len(self._entries)}
+
+
+def _strip_think(response: str) -> str: return re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL)
+
+
+def _is_valid(resp: dict) -> bool:
+    return bool(resp.get("thought") and (resp.get("action") or resp.get("actions") or resp.get("final_answer")))
+
+
+def _retry_prompt(prompt: str, prev_response: str) -> str:
+    """The original prompt comes first, so the retry shares its cached prefix."""
+    return f"""{prompt}
+
+Your previous response was not in the correct JSON format:
+{prev_response}
+
+Please provide a valid JSON response as specified above.
+"""
+
+
 class Tool:
-    """Represents an agent tool."""
+    """Represents an agent tool.
+
+    A `cacheable` tool must be pure: its results are memoized by normalized arguments (defaults applied, keys
+    sorted) for `ttl` seconds, or until evicted, keeping the `max_size` most recently used. Errors are not cached."""
 
-    def __init__(self, name: str, func: Callable, desc: str = None):
+    def __init__(self, name: str, func: Callable, desc: str = None,
+                 cacheable: bool = False, ttl: float = None, max_size: int = 128):
         self.name = name
         self.func = func
         self.desc = desc or func.__doc__.strip() or f"{name} tool"
         self.schema = _parse_schema(func)
-
-    def execute(self, **kwargs): return self.func(**kwargs)
+        self.cacheable, self.ttl, self.max_size = cacheable, ttl, max_size
+        self.hits = self.misses = 0
+        self._results: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, kwargs: dict) -> str:
+        bound = inspect.signature(self.func).bind(**kwargs)
+        bound.apply_defaults()
+        return json.dumps(bound.arguments, sort_keys=True, default=repr)
+
+    def _lookup(self, kwargs: dict) -> Tuple[Optional[str], bool, Any]:
+        """(key, found, result); the key is None for tools that are not cacheable."""
+        if not self.cacheable:
+            return None, False, None
+        key = self._key(kwargs)
+        with self._lock:
+            if (entry := self._results.get(key)) and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self._results.move_to_end(key)
+                self.hits += 1
+                return key, True, entry[1]
+            self.misses += 1
+            return key, False, None
+
+    def _store(self, key: str, result: Any):
+        with self._lock:
+            self._results[key] = (time.monotonic(), result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def execute(self, **kwargs):
+        key, found, result = self._lookup(kwargs)
+        if found:
+            return result
+        result = asyncio.run(self.func(**kwargs)) if _is_async(self.func) else self.func(**kwargs)
+        if key:
+            self._store(key, result)
+        return result
+
+    async def aexecute(self, **kwargs):
+        key, found, result = self._lookup(kwargs)
+        if found:
+            return result
+        result = await _acall(self.func, **kwargs)
+        if key:
+            self._store(key, result)
+        return result
+
+    def stats(self) -> dict:
+        calls = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / calls if calls else 0.0,
+                "size": len(self._results)}
 
     def __str__(self): return f"Tool: {self.name}\nDesc: {self.desc}\nArgs: {self.schema}"
 
@@ -27,41 +206,59 @@ class Tool:
 class ToolRegistry:
     """Manages tool collection."""
 
-    def __init__(self): self.tools: Dict[str, Tool] = {}
+    def __init__(self):
+        self.tools: Dict[str, Tool] = {}
+        self._listing: Optional[str] = None
 
-    def register(self, tool: Tool): self.tools[tool.name] = tool
+    def register(self, tool: Tool):
+        self.tools[tool.name] = tool
+        self._listing = None
 
     def get(self, name: str) -> Optional[Tool]: return self.tools.get(name)
 
-    def list(self) -> str: return "\n\n".join(map(str, self.tools.values()))
+    def list(self) -> str:
+        if self._listing is None:
+            self._listing = "\n\n".join(map(str, self.tools.values()))
+        return self._listing
 
-    def decorator(self, name: str, desc: str = None):
+    def stats(self) -> Dict[str, dict]:
+        """Cache hit rates of the cacheable tools."""
+        return {name: tool.stats() for name, tool in self.tools.items() if tool.cacheable}
+
+    def decorator(self, name: str, desc: str = None, **cache_options):
         def wrap(func):
-            self.register(Tool(name, func, desc))
+            self.register(Tool(name, func, desc, **cache_options))
             return func
 
         return wrap
 
 
 class Step:
-    """Single reasoning step."""
+    """Single reasoning step, with the (action, input, observation) of each tool call it made."""
 
     def __init__(self, thought: str, index: int = 1):
         self.index = index
         self.thought = thought
-        self.action = None
-        self.input = None
-        self.obs = None
+        self.calls: List[list] = []
+
+    @property
+    def action(self): return self.calls[0][0] if self.calls else None
 
-    def set_action(self, action: str, input: dict): self.action, self.input = action, input
+    @property
+    def input(self): return self.calls[0][1] if self.calls else None
 
-    def set_obs(self, obs: str): self.obs = obs
+    @property
+    def obs(self): return self.calls[0][2] if self.calls else None
+
+    def set_action(self, action: str, input: dict): self.calls.append([action, input, None])
+
+    def set_obs(self, obs: str): self.calls[-1][2] = obs
 
     def __str__(self):
-        return f"\n--- Iteration:{self.index} ---\nthought: {self.thought}\n" + \
-            (f"action: {self.action}\n" if self.action else "") + \
-            (f"action_input: {self.input}\n" if self.input else "") + \
-            (f"observation: {self.obs}\n" if self.obs else "")
+        return f"\n--- Iteration:{self.index} ---\nthought: {self.thought}\n" + "".join(
+            (f"action: {action}\n" if action else "") +
+            (f"action_input: {input}\n" if input else "") +
+            (f"observation: {obs}\n" if obs else "") for action, input, obs in self.calls)
 
 
 class ResponseParser:
@@ -76,14 +273,27 @@ class ResponseParser:
                 pass
         return {"thought": text, "action": "", "action_input": ""}
 
+    @staticmethod
+    def actions(resp: dict) -> List[Tuple[str, dict]]:
+        """(action, inputs) of every tool call in a response, from "actions" or a single "action"."""
+        calls = resp.get("actions") or ([{"action": resp["action"], "action_input": resp.get("action_input")}]
+                                        if resp.get("action") else [])
+        return [(c["action"], c["action_input"] if isinstance(c["action_input"], dict) else json.loads(c["action_input"]))
+                for c in calls]
+
 
 class PromptFormatter:
-    """Formats LLM prompts."""
+    """Formats the LLM prompts of one task.
 
-    @staticmethod
-    def format(task: str, tools: ToolRegistry, history: List[Step]) -> str:
-        return f"""
-You are an AI agent tasked with {task}. Use critical reasoning and these tools:
+    The tools and instructions come first and are the same for every task, then the task, then the history,
+    which only grows at the end: each prompt extends the one before it, so provider-side prompt caching can
+    reuse the prefix. Each step is rendered once, when it first appears in the history."""
+
+    NO_HISTORY = "No history present, this is the first iteration"
+
+    def __init__(self, task: str, tools: ToolRegistry):
+        self.head = f"""
+You are an AI agent. Use critical reasoning and these tools:
 
 Tools:
 {tools.list()}
@@ -92,27 +302,78 @@ Respond with JSON in markdown code block format:
   "thought": <your internal reasoning>,
   "action": <tool name>,
   "action_input": <params as JSON string>
+  "actions": <optional, instead of action/action_input: a list of {{"action": ..., "action_input": ...}} for independent tool calls that can run together>
   "final_answer": <when you have the final answer after a few iterations, provide it here>
 
+Important: Provide only valid JSON without any introduction, explanation, or additional text. No Preamble.
+
+Task: {task}
+
 History:
-{"".join(map(str, history)) if history else "No history present, this is the first iteration"}
+""".lstrip()
+        self._steps: List[str] = []
 
-Important: Provide only valid JSON without any introduction, explanation, or additional text. No Preamble.
-""".strip()
+    def render(self, history: List[Step]) -> str:
+        """Prompt for the history so far; steps must be complete (observations set) once they are rendered."""
+        self._steps.extend(map(str, history[len(self._steps):]))
+        return self.head + ("".join(self._steps) or self.NO_HISTORY)
+
+    @staticmethod
+    def format(task: str, tools: ToolRegistry, history: List[Step]) -> str:
+        return PromptFormatter(task, tools).render(history)
 
 
 class Agent:
     """ReACT-based agent with retry mechanism."""
 
-    def __init__(self, llm: Callable[[str], str], max_steps: int = 10, max_retries: int = 3):
+    def __init__(self, llm: Callable[[str], str], max_steps: int = 10, max_retries: int = 3,
+                 rate_limiter: RateLimiter = None, verbose: bool = True,
+                 cache: ResponseCache = None, llm_params: dict = None):
+        """`llm_params` (model, temperature, ...) only go into the cache key, so responses of different
+        settings are kept apart."""
         self.llm, self.max_steps, self.max_retries = llm, max_steps, max_retries
+        self.rate_limiter, self.verbose = rate_limiter, verbose
+        self.cache, self.llm_params = cache, llm_params
         self.registry, self.parser = ToolRegistry(), ResponseParser()
 
-    def tool(self, name: str):
-        return self.registry.decorator(name)
-
-    def add_tool(self, name: str, func: Callable, desc: str = None):
-        self.registry.register(Tool(name, func, desc))
+    def _log(self, text: str):
+        if self.verbose:
+            print(text)
+
+    def _cached(self, prompt: str, use_cache: bool) -> Tuple[Optional[str], Optional[str]]:
+        """(cache key, cached response); the key is None when the cache is off for this call."""
+        if not (self.cache and use_cache):
+            return None, None
+        return (key := ResponseCache.key(prompt, self.llm_params)), self.cache.get(key)
+
+    def _call_llm(self, prompt: str, use_cache: bool = True) -> str:
+        key, response = self._cached(prompt, use_cache)
+        if response is not None:
+            return response
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+        response = _strip_think(self.llm(prompt))
+        if key:
+            self.cache.put(key, response)
+        return response
+
+    async def _acall_llm(self, prompt: str, use_cache: bool = True) -> str:
+        key, response = self._cached(prompt, use_cache)
+        if response is not None:
+            return response
+        if self.rate_limiter:
+            await self.rate_limiter.await_slot()
+        response = _strip_think(await _acall(self.llm, prompt))
+        if key:
+            self.cache.put(key, response)
+        return response
+
+    def tool(self, name: str, desc: str = None, cacheable: bool = False, ttl: float = None, max_size: int = 128):
+        return self.registry.decorator(name, desc, cacheable=cacheable, ttl=ttl, max_size=max_size)
+
+    def add_tool(self, name: str, func: Callable, desc: str = None,
+                 cacheable: bool = False, ttl: float = None, max_size: int = 128):
+        self.registry.register(Tool(name, func, desc, cacheable, ttl, max_size))
 
     def _execute_with_retry(self, tool: Tool, inputs: dict) -> str:
         for attempt in range(self.max_retries):
@@ -124,51 +385,118 @@ class Agent:
                 continue
         return "Unexpected retry failure"
 
-    def _retry_llm(self, prompt: str, prev_response: str = None) -> dict:
+    def _retry_llm(self, prompt: str, prev_response: str = None, use_cache: bool = True) -> dict:
         for attempt in range(self.max_retries):
             if attempt > 0:
-                retry_prompt = f"""
-Your previous response was not in the correct JSON format:
-{prev_response}
-
-Please provide a valid JSON response as specified in the original prompt:
-{prompt}
-"""
-                response = re.sub(r'<think>.*?</think>', '', self.llm(retry_prompt), flags=re.DOTALL)
+                response = self._call_llm(_retry_prompt(prompt, prev_response), use_cache)
                 resp_dict = self.parser.parse(response)
-                if resp_dict.get("thought") and (resp_dict.get("action") or resp_dict.get("final_answer")):
-                    print(f"\n{15 * '='} LLM Response After Retrying {15 * '='}\n{response}\n\n")
+                if _is_valid(resp_dict):
+                    self._log(f"\n{15 * '='} LLM Response After Retrying {15 * '='}\n{response}\n\n")
                     return resp_dict
                 prev_response = response
         raise Exception("Max retries reached")
 
-    def run(self, task: str) -> str:
+    def run(self, task: str, use_cache: bool = True) -> str:
+        history: List[Step] = []
+        formatter = PromptFormatter(task, self.registry)
+        for i in range(self.max_steps):
+            prompt = formatter.render(history)
+            self._log(f'\nIteration: {i + 1}\n{15 * "="} PROMPT {15 * "="}\n{prompt}\n')
+
+            response = self._call_llm(prompt, use_cache)
+            self._log(f"\n{15 * '='} LLM Response {15 * '='}\n{response}\n\n")
+            resp_dict = self.parser.parse(response)
+
+            if not _is_valid(resp_dict):
+                resp_dict = self._retry_llm(prompt, response, use_cache)
+
+            step = Step(resp_dict.get("thought"), i + 1)
+            history.append(step)
+
+            if final := resp_dict.get("final_answer"):
+                return final
+
+            if actions := self.parser.actions(resp_dict):
+                for action, inputs in actions:
+                    tool = self.registry.get(action)
+                    obs = self._execute_with_retry(tool, inputs) if tool else f"Tool '{action}' not found"
+                    step.set_action(action, inputs)
+                    step.set_obs(obs)
+            else:
+                raise Exception("No action or final answer")
+
+        raise Exception("Max steps reached")
+
+    async def _aexecute_with_retry(self, tool: Tool, inputs: dict) -> str:
+        for attempt in range(self.max_retries):
+            try:
+                return str(await tool.aexecute(**inputs))
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    return f"Error after {self.max_retries} retries: {e}"
+        return "Unexpected retry failure"
+
+    async def _aobserve(self, action: str, inputs: dict) -> str:
+        tool = self.registry.get(action)
+        return await self._aexecute_with_retry(tool, inputs) if tool else f"Tool '{action}' not found"
+
+    async def _aretry_llm(self, prompt: str, prev_response: str = None, use_cache: bool = True) -> dict:
+        for attempt in range(1, self.max_retries):
+            response = await self._acall_llm(_retry_prompt(prompt, prev_response), use_cache)
+            resp_dict = self.parser.parse(response)
+            if _is_valid(resp_dict):
+                self._log(f"\n{15 * '='} LLM Response After Retrying {15 * '='}\n{response}\n\n")
+                return resp_dict
+            prev_response = response
+        raise Exception("Max retries reached")
+
+    async def arun(self, task: str, use_cache: bool = True) -> str:
+        """Async run: the LLM and tools may be async, sync ones run on a thread pool,
+        and the tool calls of one response run concurrently."""
         history: List[Step] = []
+        formatter = PromptFormatter(task, self.registry)
         for i in range(self.max_steps):
-            prompt = PromptFormatter.format(task, self.registry, history)
-            print(f'\nIteration: {i + 1}\n{15 * "="} PROMPT {15 * "="}\n{prompt}\n')
+            prompt = formatter.render(history)
+            self._log(f'\nIteration: {i + 1}\n{15 * "="} PROMPT {15 * "="}\n{prompt}\n')
 
-            response = re.sub(r'<think>.*?</think>', '', self.llm(prompt), flags=re.DOTALL)
-            print(f"\n{15 * '='} LLM Response {15 * '='}\n{response}\n\n")
+            response = await self._acall_llm(prompt, use_cache)
+            self._log(f"\n{15 * '='} LLM Response {15 * '='}\n{response}\n\n")
             resp_dict = self.parser.parse(response)
 
-            if not (thought := resp_dict.get("thought") and (resp_dict.get("action") or resp_dict.get("final_answer"))):
-                resp_dict = self._retry_llm(prompt, response)
+            if not _is_valid(resp_dict):
+                resp_dict = await self._aretry_llm(prompt, response, use_cache)
 
-            step = Step(thought, i + 1)
+            step = Step(resp_dict.get("thought"), i + 1)
             history.append(step)
 
             if final := resp_dict.get("final_answer"):
                 return final
 
-            if action := resp_dict.get("action"):
-                inputs = resp_dict["action_input"] if isinstance(resp_dict["action_input"], dict) else json.loads(
-                    resp_dict["action_input"])
-                tool = self.registry.get(action)
-                obs = self._execute_with_retry(tool, inputs) if tool else f"Tool '{action}' not found"
-                step.set_action(action, inputs)
-                step.set_obs(obs)
+            if actions := self.parser.actions(resp_dict):
+                observations = await asyncio.gather(*(self._aobserve(action, inputs) for action, inputs in actions))
+                for (action, inputs), obs in zip(actions, observations):
+                    step.set_action(action, inputs)
+                    step.set_obs(obs)
             else:
                 raise Exception("No action or final answer")
 
         raise Exception("Max steps reached")
+
+    async def arun_many(self, tasks: List[str], max_concurrency: int = 8, use_cache: bool = True) -> List[Any]:
+        """Run tasks concurrently, at most max_concurrency at once, each with its own history.
+        Returns each task's answer, or the exception it raised, in task order."""
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_one(task: str) -> str:
+            async with semaphore:
+                return await self.arun(task, use_cache)
+
+        with ThreadPoolExecutor(max_concurrency) as executor:
+            token = _executor.set(executor)
+            try:
+                return await asyncio.gather(*map(run_one, tasks), return_exceptions=True)
+            finally:
+                _executor.reset(token)
+
+    def run_many(self, tasks: List[str], max_concurrency: int = 8, use_cache: bool = True) -> List[Any]:
+        return asyncio.run(self.arun_many(tasks, max_concurrency, use_cache))
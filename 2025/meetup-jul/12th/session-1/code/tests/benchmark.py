@@ -0,0 +1,39 @@
+import time
+
+from nanoagents import Agent, RateLimiter
+
+TASKS = 200
+
+
+def stub_llm(prompt: str) -> str:
+    """Stub LLM with ~50 ms latency: calls add on the first iteration, answers on the second."""
+    time.sleep(0.05)
+    if "No history present" in prompt:
+        return '```json\n{"thought": "add them", "action": "add", "action_input": {"a": 2, "b": 3}}\n```'
+    return '```json\n{"thought": "done", "final_answer": "5"}\n```'
+
+
+def add(a: int, b: int) -> int:
+    """Use this tool to add two numbers"""
+    time.sleep(0.02)
+    return a + b
+
+
+def bench(agent: Agent, concurrency: int, tasks: int = TASKS):
+    start = time.perf_counter()
+    results = agent.run_many([f"adding 2 and 3 (#{i})" for i in range(tasks)], max_concurrency=concurrency)
+    elapsed = time.perf_counter() - start
+    failures = sum(isinstance(r, Exception) for r in results)
+    print(f"concurrency {concurrency:>3}: {tasks / elapsed:7.1f} tasks/s, {failures} failures")
+
+
+if __name__ == "__main__":
+    agent = Agent(stub_llm, verbose=False)
+    agent.add_tool("add", add)
+    for concurrency in (1, 4, 16, 64):
+        bench(agent, concurrency, TASKS if concurrency > 1 else TASKS // 4)
+
+    limited = Agent(stub_llm, verbose=False, rate_limiter=RateLimiter(100, period=1.0))
+    limited.add_tool("add", add)
+    print("rate limited to 100 LLM calls/s:")
+    bench(limited, 64)